@@ -54,12 +54,92 @@ var Simple_Continuous_Module = function(canvas_width, canvas_height, ids) {
 	var context = canvas.getContext("2d");
 	var canvasDraw = new ContinuousVisualization(canvas_width, canvas_height, context);
 
+	// State kept between delta frames (see ContinuousCanvas.render_delta)
+	var palette = {};
+	var objects = {};
+
+	var applyDelta = function(data) {
+		if (data.reset) {
+			palette = {};
+			objects = {};
+		}
+		for (var s in data.styles)
+			palette[s] = data.styles[s];
+		for (var i = 0; i < data.set.length; i += 2) {
+			var h = data.set[i];
+			if (!(h in objects))
+				objects[h] = {x: 0, y: 0, angle: 0};
+			objects[h].style = data.set[i + 1];
+		}
+		for (var i = 0; i < data.ids.length; i++) {
+			var o = objects[data.ids[i]];
+			o.x = data.x[i];
+			o.y = data.y[i];
+			o.angle = data.a[i];
+		}
+		for (var i = 0; i < data.removed.length; i++)
+			delete objects[data.removed[i]];
+
+		var layers = {};
+		for (var h in objects) {
+			var o = objects[h];
+			var p = palette[o.style];
+			if (!(p.Layer in layers))
+				layers[p.Layer] = [];
+			layers[p.Layer].push(Object.assign({}, p, {x: o.x, y: o.y, angle: o.angle}));
+		}
+		return layers;
+	};
+
+	// Palette kept between binary frames (see wire.BinaryFrameEncoder)
+	var binaryPalette = {};
+
+	var decodeArray = function(b64, Type) {
+		var bytes = atob(b64);
+		var buffer = new Uint8Array(bytes.length);
+		for (var i = 0; i < bytes.length; i++)
+			buffer[i] = bytes.charCodeAt(i);
+		return new Type(buffer.buffer);
+	};
+
+	var decodeBinary = function(data) {
+		if (data.reset)
+			binaryPalette = {};
+		for (var s in data.palette)
+			binaryPalette[s] = data.palette[s];
+		var xy = decodeArray(data.xy, Float32Array);
+		var style = decodeArray(data.style, data.styleBytes == 2 ? Uint16Array : Uint8Array);
+		var angle = data.angle ? decodeArray(data.angle, Float32Array) : null;
+		var layers = {};
+		var i = 0;
+		for (var l = 0; l < data.layers.length; l++) {
+			var layer = layers[data.layers[l]] = [];
+			for (var end = i + data.counts[l]; i < end; i++) {
+				var p = Object.assign({}, binaryPalette[style[i]]);
+				p.x = xy[2 * i];
+				p.y = xy[2 * i + 1];
+				if (angle && !isNaN(angle[i]))
+					p.angle = angle[i];
+				layer.push(p);
+			}
+		}
+		return layers;
+	};
+
 	this.render = function(data) {
 		canvasDraw.resetCanvas();
-		canvasDraw.draw(data);
+		if (data.binary)
+			canvasDraw.draw(decodeBinary(data));
+		else if (data.delta)
+			canvasDraw.draw(applyDelta(data));
+		else
+			canvasDraw.draw(data);
 	};
 
 	this.reset = function() {
+		binaryPalette = {};
+		palette = {};
+		objects = {};
 		canvasDraw.resetCanvas();
 	};
 
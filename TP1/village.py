@@ -1,60 +1,303 @@
+import csv
+import itertools
 import math
-import random
-import uuid
+import multiprocessing
+import time
 from collections import defaultdict
 
 import mesa
+import numpy as np
 import tornado, tornado.ioloop
 from mesa import space
 from mesa.time import RandomActivation
-from mesa.datacollection import DataCollector
-from mesa.visualization.ModularVisualization import ModularServer, VisualizationElement
-from mesa.visualization.modules.ChartVisualization import ChartModule
+from mesa.visualization.ModularVisualization import VisualizationElement
 from mesa.visualization.ModularVisualization import UserSettableParameter
 
 from mesa.batchrunner import BatchRunner
 
+from collector import ColumnarDataCollector
+from ids import IdAllocator, model_streams
+from frameserver import FrameServer, HistoryChartModule
+from wire import BinaryFrameEncoder
+
+INFECTION_RADIUS = 40.0
+CURE_RADIUS = 30.0
+KILL_RADIUS = 40.0
+
+
+class SpatialHash:
+    # Uniform grid of square cells, agents are bucketed by the cell containing their pos.
+    def __init__(self, cell_size):
+        self.cell_size = cell_size
+        self.cells = defaultdict(set)
+        self.cellOf = {}
+
+    def cell(self, pos):
+        return int(pos[0] // self.cell_size), int(pos[1] // self.cell_size)
+
+    def insert(self, agent):
+        c = self.cell(agent.pos)
+        self.cells[c].add(agent)
+        self.cellOf[agent] = c
+
+    def remove(self, agent):
+        c = self.cellOf.pop(agent)
+        self.cells[c].discard(agent)
+        if not self.cells[c]:
+            del self.cells[c]
+
+    def move(self, agent, pos):
+        agent.pos = pos
+        c = self.cell(pos)
+        old = self.cellOf[agent]
+        if c != old:
+            self.cells[old].discard(agent)
+            if not self.cells[old]:
+                del self.cells[old]
+            self.cells[c].add(agent)
+            self.cellOf[agent] = c
+
+    def query(self, pos, r):
+        x, y = pos
+        r2 = r * r
+        cx0, cy0 = self.cell((x - r, y - r))
+        cx1, cy1 = self.cell((x + r, y + r))
+        found = []
+        for cx in range(cx0, cx1 + 1):
+            for cy in range(cy0, cy1 + 1):
+                bucket = self.cells.get((cx, cy))
+                if not bucket:
+                    continue
+                for u in bucket:
+                    if (x - u.pos[0]) ** 2 + (y - u.pos[1]) ** 2 <= r2:
+                        found.append(u)
+        return found
+
+
+def pairs_within(src_x, src_y, dst_x, dst_y, r):
+    # Index pairs (i_src, i_dst) closer than r, found by binning sources in cells of size r
+    # so that only the 3x3 neighbouring cells of each destination are compared.
+    if len(src_x) == 0 or len(dst_x) == 0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    scx = (src_x // r).astype(np.int64) + 1
+    scy = (src_y // r).astype(np.int64) + 1
+    dcx = (dst_x // r).astype(np.int64) + 1
+    dcy = (dst_y // r).astype(np.int64) + 1
+    k = max(scy.max(), dcy.max()) + 2
+    order = np.argsort(scx * k + scy, kind="stable")
+    skeys = (scx * k + scy)[order]
+    srcIdx, dstIdx = [], []
+    for ox in (-1, 0, 1):
+        for oy in (-1, 0, 1):
+            keys = (dcx + ox) * k + (dcy + oy)
+            lo = np.searchsorted(skeys, keys, "left")
+            cnt = np.searchsorted(skeys, keys, "right") - lo
+            total = cnt.sum()
+            if total == 0:
+                continue
+            d = np.repeat(np.arange(len(keys)), cnt)
+            s = order[np.repeat(lo - np.cumsum(cnt) + cnt, cnt) + np.arange(total)]
+            close = (src_x[s] - dst_x[d]) ** 2 + (src_y[s] - dst_y[d]) ** 2 <= r * r
+            srcIdx.append(s[close])
+            dstIdx.append(d[close])
+    if not srcIdx:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    return np.concatenate(srcIdx), np.concatenate(dstIdx)
+
+
+VILLAGER, CLERIC, HUNTER = 0, 1, 2
+
+
+class ArrayVillage:
+    # Array-backed engine: every agent is a row, and each rule is applied to all rows at once
+    # in the order transformation, infection, curing, killing, movement.
+    def __init__(self, model, n_villagers, n_loupGrou, n_cleric, n_hunter, speed=10):
+        self.model = model
+        self.speed = speed
+        n = n_villagers + n_loupGrou + n_cleric + n_hunter
+        self.x = self.model.rng.random(n) * 500
+        self.y = self.model.rng.random(n) * 500
+        self.kind = np.repeat(np.array([VILLAGER, VILLAGER, CLERIC, HUNTER], dtype=np.int8),
+                              [n_villagers, n_loupGrou, n_cleric, n_hunter])
+        self.isLoupGarou = np.zeros(n, dtype=bool)
+        self.isLoupGarou[n_villagers:n_villagers + n_loupGrou] = True
+        self.isTransformed = np.zeros(n, dtype=bool)
+        self.ids = np.arange(n)
+        self.updateCounts()
+
+    def updateCounts(self):
+        villager = self.kind == VILLAGER
+        self.model.populationSize = int(np.count_nonzero(villager))
+        self.model.humansSize = int(np.count_nonzero(villager & ~self.isLoupGarou))
+        self.model.werewolvesSize = int(np.count_nonzero(self.isLoupGarou & ~self.isTransformed))
+        self.model.transformedWerewolvesSize = int(np.count_nonzero(self.isTransformed))
+        self.model.clericsSize = int(np.count_nonzero(self.kind == CLERIC))
+        self.model.huntersSize = int(np.count_nonzero(self.kind == HUNTER))
+
+    def step(self):
+        n = len(self.x)
+        villager = self.kind == VILLAGER
+        self.isTransformed |= self.isLoupGarou & (self.model.rng.random(n) <= 0.1)
+
+        src = np.flatnonzero(self.isTransformed)
+        dst = np.flatnonzero(villager)
+        _, hit = pairs_within(self.x[src], self.y[src], self.x[dst], self.y[dst], INFECTION_RADIUS)
+        self.isLoupGarou[dst[hit]] = True
+
+        src = np.flatnonzero(self.kind == CLERIC)
+        dst = np.flatnonzero(villager & ~self.isTransformed)
+        _, hit = pairs_within(self.x[src], self.y[src], self.x[dst], self.y[dst], CURE_RADIUS)
+        self.isLoupGarou[dst[hit]] = False
+
+        src = np.flatnonzero(self.kind == HUNTER)
+        dst = np.flatnonzero(self.isTransformed)
+        _, hit = pairs_within(self.x[src], self.y[src], self.x[dst], self.y[dst], KILL_RADIUS)
+        if len(hit):
+            alive = np.ones(n, dtype=bool)
+            alive[dst[hit]] = False
+            for name in ("x", "y", "kind", "isLoupGarou", "isTransformed", "ids"):
+                setattr(self, name, getattr(self, name)[alive])
+            n = len(self.x)
+
+        r = self.model.rng.random(n) * math.pi * 2
+        space = self.model.space
+        self.x = np.clip(self.x + np.cos(r) * self.speed, space.x_min, space.x_max)
+        self.y = np.clip(self.y + np.sin(r) * self.speed, space.y_min, space.y_max)
+        self.updateCounts()
+
+    def portrayals(self):
+        colors = np.array(["blue", "red", "green", "black"])
+        color = np.where(self.kind == VILLAGER, np.where(self.isLoupGarou, 1, 0), self.kind + 1)
+        for i in range(len(self.x)):
+            yield int(self.ids[i]), (float(self.x[i]), float(self.y[i])), {"Shape": "circle",
+                                                                          "Filled": "true",
+                                                                          "Layer": 1,
+                                                                          "Color": str(colors[color[i]]),
+                                                                          "r": 6 if self.isTransformed[i] else 3}
+
+
 class Village(mesa.Model):
 
-    def __init__(self, n_villagers, n_loupGrou, n_cleric, n_hunter):
+    def __init__(self, n_villagers, n_loupGrou, n_cleric, n_hunter, engine="agents", stop_at_fixed_point=True,
+                 seed=None, collector_options=None):
         mesa.Model.__init__(self)
+        self.rng, self.random = model_streams(seed)
+        self.idAllocator = IdAllocator()
         self.space = mesa.space.ContinuousSpace(600, 600, False)
         self.schedule = RandomActivation(self)
+        self.grid = SpatialHash(max(INFECTION_RADIUS, CURE_RADIUS, KILL_RADIUS))
+        self.populationSize = 0
+        self.humansSize = 0
+        self.werewolvesSize = 0
+        self.transformedWerewolvesSize = 0
+        self.clericsSize = 0
+        self.huntersSize = 0
+        self.stop_at_fixed_point = stop_at_fixed_point
+        self.terminationReason = None
+        self.terminationStep = None
+        self.engine = None
+        if engine == "numpy":
+            self.engine = ArrayVillage(self, n_villagers, n_loupGrou, n_cleric, n_hunter)
+            n_villagers = n_loupGrou = n_cleric = n_hunter = 0
+        elif engine != "agents":
+            raise ValueError("Unknown engine " + repr(engine))
         for _ in range(n_villagers):
-            self.schedule.add(Villager(random.random() * 500, random.random() * 500, 10, int(uuid.uuid1()), self))
+            self.addAgent(Villager(self.random.random() * 500, self.random.random() * 500, 10, self.next_id(), self))
         for _ in range(n_loupGrou):
-            self.schedule.add(Villager(random.random() * 500, random.random() * 500, 10, int(uuid.uuid1()), self, True))
+            self.addAgent(Villager(self.random.random() * 500, self.random.random() * 500, 10, self.next_id(), self, True))
         for _ in range(n_cleric):
-            self.schedule.add(Cleric(random.random() * 500, random.random() * 500, 10, int(uuid.uuid1()), self))
+            self.addAgent(Cleric(self.random.random() * 500, self.random.random() * 500, 10, self.next_id(), self))
         for _ in range(n_hunter):
-            self.schedule.add(Hunter(random.random() * 500, random.random() * 500, 10, int(uuid.uuid1()), self))
-        self.dc = DataCollector({
+            self.addAgent(Hunter(self.random.random() * 500, self.random.random() * 500, 10, self.next_id(), self))
+        self.dc = ColumnarDataCollector({
             'Population': lambda m : m.getPopulationSize(),
             'Humans' : lambda m : m.getHumansSize(),
             'Werewolves' : lambda m : m.getWerewolvesSize(),
             'TransformedWerewolves' : lambda m : m.getTransformedWerewolvesSize(),
 
-        })
+        }, **(collector_options or {}))
         self.dc.collect(self)
 
+    def addAgent(self, agent):
+        self.schedule.add(agent)
+        self.grid.insert(agent)
+        agent.alive = True
+        if isinstance(agent, Villager):
+            self.countVillager(agent, 1)
+        elif isinstance(agent, Cleric):
+            self.clericsSize += 1
+        elif isinstance(agent, Hunter):
+            self.huntersSize += 1
+
+    def next_id(self):
+        return self.idAllocator.allocate()
+
+    def removeAgent(self, agent):
+        agent.alive = False
+        if isinstance(agent, Villager):
+            self.countVillager(agent, -1)
+        elif isinstance(agent, Cleric):
+            self.clericsSize -= 1
+        elif isinstance(agent, Hunter):
+            self.huntersSize -= 1
+        self.schedule.remove(agent)
+        self.grid.remove(agent)
+        self.idAllocator.release(agent.unique_id)
+
+    def countVillager(self, u, sign):
+        self.populationSize += sign
+        if not u.isLoupGarou:
+            self.humansSize += sign
+        elif not u.isTransformed:
+            self.werewolvesSize += sign
+        if u.isTransformed:
+            self.transformedWerewolvesSize += sign
+
+    def moveAgent(self, agent, pos):
+        self.grid.move(agent, pos)
+
+    def neighbors_within(self, pos, r, kind=None):
+        found = self.grid.query(pos, r)
+        if kind is not None:
+            found = [u for u in found if isinstance(u, kind)]
+        return found
 
     def getPopulationSize(self):
-        return len([u for u in self.schedule.agent_buffer() if isinstance(u,Villager) ])
+        return self.populationSize
 
     def getHumansSize(self):
-        return len([u for u in self.schedule.agent_buffer() if isinstance(u,Villager)and u.isLoupGarou==False ])
+        return self.humansSize
 
     def getWerewolvesSize(self):
-        return len([u for u in self.schedule.agent_buffer() if isinstance(u,Villager)and u.isLoupGarou==True and u.isTransformed==False ])
-    
+        return self.werewolvesSize
+
     def getTransformedWerewolvesSize(self):
-        return len([u for u in self.schedule.agent_buffer() if isinstance(u,Villager)and u.isTransformed==True ])
+        return self.transformedWerewolvesSize
+
+    def absorbingState(self):
+        # States from which none of the reported counts can change any more
+        if self.populationSize == 0:
+            return "no villagers left"
+        if self.werewolvesSize == 0 and self.transformedWerewolvesSize == 0:
+            return "no werewolves left"
+        if self.humansSize == 0 and self.werewolvesSize == 0 and self.huntersSize == 0:
+            return "no humans left and no hunters"
+        return None
 
 
     def step(self):
+        self.idAllocator.recycle()
         self.dc.collect(self)
+        if self.engine is not None:
+            self.engine.step()
         self.schedule.step()
-        if self.schedule.steps >= 1000:
+        reason = self.absorbingState() if self.stop_at_fixed_point else None
+        if reason is None and self.schedule.steps >= 1000:
+            reason = "step limit"
+        if reason is not None:
+            self.terminationReason = reason
+            self.terminationStep = self.schedule.steps
+            self.dc.collect(self)
             self.running = False
 
 
@@ -63,12 +306,20 @@ class ContinuousCanvas(VisualizationElement):
         "./js/simple_continuous_canvas.js",
     ]
 
+    dynamic_keys = ("x", "y", "angle")
+
     def __init__(self, canvas_height=500,
-                 canvas_width=500, instantiate=True):
+                 canvas_width=500, instantiate=True, delta=False, binary=False):
         VisualizationElement.__init__(self)
         self.canvas_height = canvas_height
         self.canvas_width = canvas_width
         self.identifier = "space-canvas"
+        if delta and binary:
+            raise ValueError("delta and binary frames are exclusive")
+        self.delta = delta
+        self.binary = binary
+        self.encoder = BinaryFrameEncoder()
+        self.model = None
         if (instantiate):
             new_element = ("new Simple_Continuous_Module({}, {},'{}')".
                            format(self.canvas_width, self.canvas_height, self.identifier))
@@ -77,8 +328,7 @@ class ContinuousCanvas(VisualizationElement):
     def portrayal_method(self, obj):
         return obj.portrayal_method()
 
-    def render(self, model):
-        representation = defaultdict(list)
+    def portrayals(self, model):
         for obj in model.schedule.agents:
             portrayal = self.portrayal_method(obj)
             if portrayal:
@@ -86,12 +336,69 @@ class ContinuousCanvas(VisualizationElement):
                                   (model.space.x_max - model.space.x_min))
                 portrayal["y"] = ((obj.pos[1] - model.space.y_min) /
                                   (model.space.y_max - model.space.y_min))
+            yield obj, portrayal
+        if model.engine is not None:
+            for i, (x, y), portrayal in model.engine.portrayals():
+                portrayal["x"] = ((x - model.space.x_min) /
+                                  (model.space.x_max - model.space.x_min))
+                portrayal["y"] = ((y - model.space.y_min) /
+                                  (model.space.y_max - model.space.y_min))
+                yield ("row", i), portrayal
+
+    def render(self, model):
+        if self.binary:
+            return self.encoder.encode(model, (p for _, p in self.portrayals(model)))
+        if self.delta:
+            return self.render_delta(model)
+        representation = defaultdict(list)
+        for _, portrayal in self.portrayals(model):
             representation[portrayal["Layer"]].append(portrayal)
         return representation
 
+    def render_delta(self, model):
+        # Each drawn object gets a small handle. Its style (everything but x, y, angle) is sent
+        # once as an index into a palette, then only handles whose position changed are sent.
+        reset = model is not self.model
+        if reset:
+            self.model = model
+            self.handles = {}
+            self.sent = {}
+            self.styles = {}
+            self.nextHandle = 0
+        frame = {"delta": True, "reset": reset, "styles": {}, "set": [],
+                 "ids": [], "x": [], "y": [], "a": [], "removed": []}
+        seen = set()
+        for key, portrayal in self.portrayals(model):
+            h = self.handles.get(key)
+            if h is None:
+                h = self.handles[key] = self.nextHandle
+                self.nextHandle += 1
+            seen.add(h)
+            style = tuple(sorted((k, v) for k, v in portrayal.items() if k not in self.dynamic_keys))
+            s = self.styles.get(style)
+            if s is None:
+                s = self.styles[style] = len(self.styles)
+                frame["styles"][s] = dict(style)
+            pos = (portrayal["x"], portrayal["y"], portrayal.get("angle", 0))
+            old = self.sent.get(h)
+            if old is None or old[0] != s:
+                frame["set"] += (h, s)
+            if old is None or old[1] != pos:
+                frame["ids"].append(h)
+                frame["x"].append(pos[0])
+                frame["y"].append(pos[1])
+                frame["a"].append(pos[2])
+            self.sent[h] = (s, pos)
+        for key, h in list(self.handles.items()):
+            if h not in seen:
+                del self.handles[key]
+                del self.sent[h]
+                frame["removed"].append(h)
+        return frame
+
 
 def wander(x, y, speed, model):
-    r = random.random() * math.pi * 2
+    r = model.random.random() * math.pi * 2
     new_x = max(min(x + math.cos(r) * speed, model.space.x_max), model.space.x_min)
     new_y = max(min(y + math.sin(r) * speed, model.space.y_max), model.space.y_min)
 
@@ -106,6 +413,7 @@ class Villager(mesa.Agent):
         self.model = model
         self.isLoupGarou = isLoupGarou
         self.isTransformed=False
+        self.alive = False
 
     def portrayal_method(self):
         if self.isLoupGarou : 
@@ -123,29 +431,37 @@ class Villager(mesa.Agent):
                      "r": r}
         return portrayal
 
+    def setState(self, isLoupGarou, isTransformed):
+        if (isLoupGarou, isTransformed) == (self.isLoupGarou, self.isTransformed):
+            return
+        if self.alive:
+            self.model.countVillager(self, -1)
+        self.isLoupGarou = isLoupGarou
+        self.isTransformed = isTransformed
+        if self.alive:
+            self.model.countVillager(self, 1)
+
     def cure(self):
-        self.isLoupGarou=False
+        self.setState(False, self.isTransformed)
 
     def kill(self):
-        self.model.schedule.remove(self)
+        if self.alive:
+            self.model.removeAgent(self)
 
     def makeLoupGarou(self):
-        self.isLoupGarou=True
+        self.setState(True, self.isTransformed)
 
     def transform(self):
-        self.makeLoupGarou()
-        self.isTransformed=True
+        self.setState(True, True)
 
     def step(self):
         if self.isLoupGarou :
-            if self.isTransformed==False  and random.random()<=0.1:
+            if self.isTransformed==False  and self.random.random()<=0.1:
                 self.transform()
         if self.isTransformed :
-            attacked = [u for u in self.model.schedule.agent_buffer() if ((self.pos[0]-u.pos[0])**2 + (self.pos[1]-u.pos[1])**2 <=40.0**2)]
-            for u in attacked :
-                if isinstance(u, Villager):
-                    u.makeLoupGarou()
-        self.pos = wander(self.pos[0], self.pos[1], self.speed, self.model)
+            for u in self.model.neighbors_within(self.pos, INFECTION_RADIUS, kind=Villager):
+                u.makeLoupGarou()
+        self.model.moveAgent(self, wander(self.pos[0], self.pos[1], self.speed, self.model))
         
 class Cleric(mesa.Agent):
     def __init__(self, x, y, speed, unique_id: int, model: Village):
@@ -165,11 +481,10 @@ class Cleric(mesa.Agent):
         return portrayal
 
     def step(self):
-        toCure = [u for u in self.model.schedule.agent_buffer() if ((self.pos[0]-u.pos[0])**2 + (self.pos[1]-u.pos[1])**2 <=30.0**2)]
-        for u in toCure :
-            if isinstance(u, Villager) and u.isTransformed==False:
+        for u in self.model.neighbors_within(self.pos, CURE_RADIUS, kind=Villager):
+            if u.isTransformed==False:
                 u.cure()
-        self.pos = wander(self.pos[0], self.pos[1], self.speed, self.model)
+        self.model.moveAgent(self, wander(self.pos[0], self.pos[1], self.speed, self.model))
 
 class Hunter(mesa.Agent):
     def __init__(self, x, y, speed, unique_id: int, model: Village):
@@ -189,16 +504,15 @@ class Hunter(mesa.Agent):
         return portrayal
 
     def step(self):
-        toKill = [u for u in self.model.schedule.agent_buffer() if ((self.pos[0]-u.pos[0])**2 + (self.pos[1]-u.pos[1])**2 <=40.0**2)]
-        for u in toKill :
-            if isinstance(u, Villager) and u.isTransformed==True:   
+        for u in self.model.neighbors_within(self.pos, KILL_RADIUS, kind=Villager):
+            if u.isTransformed==True:
                 u.kill()
-        self.pos = wander(self.pos[0], self.pos[1], self.speed, self.model)
+        self.model.moveAgent(self, wander(self.pos[0], self.pos[1], self.speed, self.model))
 
-def run_single_server():
-    server = ModularServer(Village,
-                           [ContinuousCanvas(),
-                           ChartModule(series =[{'Label':"Population","Color":"orange"},
+def run_single_server(steps_per_frame=1, free_run=False):
+    server = FrameServer(Village,
+                           [ContinuousCanvas(delta=True),
+                           HistoryChartModule(series =[{'Label':"Population","Color":"orange"},
                                                 {"Label":"Humans","Color":"blue"},
                                                 {"Label":"Werewolves","Color":"red"},
                                                 {"Label":"TransformedWerewolves","Color":"green"}]
@@ -207,7 +521,8 @@ def run_single_server():
                            {"n_villagers": UserSettableParameter("slider","n_villagers",15, 0,20),
                             "n_loupGrou":UserSettableParameter("slider","n_loupGrou",5, 0,20),
                             "n_cleric":UserSettableParameter("slider","n_cleric",1, 0,20),
-                            "n_hunter":UserSettableParameter("slider","n_hunter",2, 0,20)})
+                            "n_hunter":UserSettableParameter("slider","n_hunter",2, 0,20)},
+                           steps_per_frame=steps_per_frame, free_run=free_run)
     server.port = 8521
     server.launch()
     tornado.ioloop.IOLoop.current().stop()
@@ -231,6 +546,46 @@ def run_batch():
     df.to_csv("Experiment.csv", index=False)
 
 
+BATCH_REPORTERS = {
+    'Humans' : lambda m : m.getHumansSize(),
+    'Population': lambda m : m.getPopulationSize(),
+    'TransformedWerewolves' : lambda m : m.getTransformedWerewolvesSize(),
+    'Werewolves' : lambda m : m.getWerewolvesSize(),
+}
+
+
+def run_experiment(task):
+    run, params, seed, max_steps = task
+    model = Village(**params, seed=seed)
+    while model.running and model.schedule.steps < max_steps:
+        model.step()
+    row = dict(params)
+    row["Run"] = run
+    for name, reporter in BATCH_REPORTERS.items():
+        row[name] = reporter(model)
+    return row
+
+
+def run_parallel_batch(params, iterations=1, max_steps=1000, seed=0, processes=None, chunksize=4,
+                       path="Experiment.csv", report_every=10):
+    # Every (configuration, replicate) pair is one task with its own seed, so a run can be
+    # replayed alone with run_experiment. Rows are written as soon as a worker returns them.
+    configs = [dict(zip(params, values)) for values in itertools.product(*params.values())]
+    configs = [c for c in configs for _ in range(iterations)]
+    seeds = np.random.SeedSequence(seed).generate_state(len(configs))
+    tasks = [(run, c, int(s), max_steps) for run, (c, s) in enumerate(zip(configs, seeds))]
+    start = time.time()
+    with open(path, "w", newline="") as f, multiprocessing.Pool(processes) as pool:
+        writer = csv.DictWriter(f, fieldnames=list(params) + ["Run"] + list(BATCH_REPORTERS))
+        writer.writeheader()
+        for done, row in enumerate(pool.imap_unordered(run_experiment, tasks, chunksize), 1):
+            writer.writerow(row)
+            if done % report_every == 0 or done == len(tasks):
+                f.flush()
+                elapsed = time.time() - start
+                print("{}/{} runs, {:.1f} runs/s".format(done, len(tasks), done / elapsed))
+
+
 if __name__ == "__main__":
     run_batch()
     #run_single_server()
@@ -0,0 +1,252 @@
+"""
+Columnar replacement for the model reporters of mesa's DataCollector.
+
+Values are stored in preallocated NumPy buffers that grow by chunks. A collector can sample
+one step out of `every`, and, when given a `spill_path`, it appends full chunks to a CSV or
+Parquet file instead of growing, so long runs keep a bounded memory footprint.
+It keeps the `collect(model)` / `model_vars[name][-1]` / `get_model_vars_dataframe()`
+interface used by the models and by ChartModule. `model_vars` covers the whole history:
+rows that were already spilled are read back from the spill file when they are asked for.
+
+A Parquet file can only be read once it is closed, so Parquet chunks are first streamed to
+`spill_path + ".arrows"` (Arrow IPC stream, readable while it grows) and `close()` converts
+that stream to `spill_path`. When a reporter's numbers widen after a chunk was written
+(integers, then floats) the stream is rewritten with the wider type; a reporter that mixes
+numbers and strings cannot be spilled to Parquet and raises TypeError.
+"""
+
+import csv
+import os
+
+import numpy as np
+
+
+def _dtype(value):
+    # Numbers and booleans get a typed buffer, anything else (strings, None...) an object one
+    dtype = np.asarray(value).dtype
+    return dtype if dtype.kind in "biufc" else np.dtype(object)
+
+
+def _widen(schema, other):
+    # Arrow schema holding the columns of both schemas, numbers promoted as NumPy does
+    import pyarrow as pa
+    fields = []
+    for field in schema:
+        old, new = field.type, other.field(field.name).type
+        if old == new or pa.types.is_null(new):
+            fields.append(field)
+        elif pa.types.is_null(old):
+            fields.append(pa.field(field.name, new))
+        else:
+            dtype = np.result_type(old.to_pandas_dtype(), new.to_pandas_dtype())
+            if dtype.kind not in "biufc":
+                raise TypeError("Reporter {!r} returned {} then {} values, which cannot be spilled to "
+                                "Parquet".format(field.name, old, new))
+            fields.append(pa.field(field.name, pa.from_numpy_dtype(dtype)))
+    return pa.schema(fields)
+
+
+class _Column:
+    # Read-only view on one reporter, returning plain Python values (JSON friendly).
+    def __init__(self, collector, name):
+        self.collector = collector
+        self.name = name
+
+    def __len__(self):
+        return self.collector._spilled + self.collector._n
+
+    def _values(self):
+        buf = self.collector._buffers.get(self.name)
+        return np.empty(0) if buf is None else buf[:self.collector._n]
+
+    def _history(self):
+        if self.collector._spilled == 0:
+            return self._values()
+        return np.concatenate([self.collector._read_spilled(self.name), self._values()])
+
+    def __getitem__(self, i):
+        spilled = self.collector._spilled
+        if isinstance(i, slice):
+            start, stop, step = i.indices(len(self))
+            if step > 0 and start >= spilled:
+                return self._values()[start - spilled:max(stop - spilled, 0):step].tolist()
+            return self._history()[i].tolist()
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("row index out of range")
+        if i >= spilled:
+            return self._values()[i - spilled:i - spilled + 1].tolist()[0]
+        return self.collector._read_spilled(self.name)[i:i + 1].tolist()[0]
+
+    def __iter__(self):
+        return iter(self._history().tolist())
+
+
+class ColumnarDataCollector:
+
+    def __init__(self, model_reporters, agent_reporters=None, every=1, chunk_size=1024,
+                 spill_path=None, spill_format=None):
+        if agent_reporters:
+            raise ValueError("ColumnarDataCollector only supports model reporters")
+        if spill_format is None:
+            spill_format = "parquet" if spill_path and spill_path.endswith(".parquet") else "csv"
+        if spill_format not in ("csv", "parquet"):
+            raise ValueError("Unknown spill format " + repr(spill_format))
+        self.model_reporters = dict(model_reporters)
+        self.every = every
+        self.chunk_size = chunk_size
+        self.spill_path = spill_path
+        self.spill_format = spill_format
+        self.model_vars = {name: _Column(self, name) for name in self.model_reporters}
+        self._calls = 0
+        self._n = 0
+        self._steps = np.empty(chunk_size, dtype=np.int64)
+        self._buffers = {}
+        self._spilled = 0
+        self._stream = None
+        self._streamPath = None
+        self._rewrites = 0
+        self._closed = False
+
+    def __len__(self):
+        # Rows collected so far, spilled ones included
+        return self._spilled + self._n
+
+    def collect(self, model):
+        call = self._calls
+        self._calls += 1
+        if call % self.every:
+            return
+        if self._n == len(self._steps):
+            if self.spill_path is not None:
+                self.flush()
+            else:
+                self._grow()
+        i = self._n
+        self._steps[i] = call
+        for name, reporter in self.model_reporters.items():
+            self._store(name, i, reporter(model))
+        self._n += 1
+
+    def _store(self, name, i, value):
+        buf = self._buffers.get(name)
+        dtype = _dtype(value)
+        if buf is None:
+            buf = np.empty(len(self._steps), dtype=dtype)
+        elif not np.can_cast(dtype, buf.dtype, casting="same_kind"):
+            buf = buf.astype(np.result_type(buf.dtype, dtype))
+        buf[i] = value
+        self._buffers[name] = buf
+
+    def _grow(self):
+        size = len(self._steps) + self.chunk_size
+        self._steps = np.resize(self._steps, size)
+        for name, buf in self._buffers.items():
+            self._buffers[name] = np.resize(buf, size)
+
+    def _columns(self):
+        columns = {"Step": self._steps[:self._n]}
+        for name in self.model_reporters:
+            columns[name] = self._buffers[name][:self._n]
+        return columns
+
+    def _openStream(self, schema):
+        import pyarrow as pa
+        if self._rewrites:
+            self._streamPath = "{}.{}.arrows".format(self.spill_path, self._rewrites)
+        else:
+            self._streamPath = self.spill_path + ".arrows"
+        f = open(self._streamPath, "wb")
+        self._stream = (f, pa.ipc.new_stream(f, schema), schema)
+
+    def _widenStream(self, schema):
+        # Copy the streamed chunks, batch by batch, to a new stream with a wider schema
+        import pyarrow as pa
+        f, writer, _ = self._stream
+        writer.close()
+        f.close()
+        old = self._streamPath
+        self._rewrites += 1
+        self._openStream(schema)
+        with pa.OSFile(old) as src:
+            for batch in pa.ipc.open_stream(src):
+                self._stream[1].write_table(pa.Table.from_batches([batch]).cast(schema))
+        os.remove(old)
+
+    def flush(self):
+        # Append the in-memory rows to spill_path and start a new chunk
+        if self.spill_path is None or self._n == 0:
+            return
+        if self._closed:
+            raise RuntimeError("Parquet spill file " + self.spill_path + " is already closed")
+        columns = self._columns()
+        if self.spill_format == "csv":
+            with open(self.spill_path, "w" if self._spilled == 0 else "a", newline="") as f:
+                writer = csv.writer(f)
+                if self._spilled == 0:
+                    writer.writerow(list(columns))
+                writer.writerows(zip(*(c.tolist() for c in columns.values())))
+        else:
+            import pyarrow as pa
+            try:
+                table = pa.table(columns)
+            except (pa.ArrowInvalid, pa.ArrowTypeError) as e:
+                raise TypeError("Reporter values cannot be spilled to Parquet: {}".format(e)) from e
+            if self._stream is None:
+                self._openStream(table.schema)
+            if table.schema != self._stream[2]:
+                schema = _widen(self._stream[2], table.schema)
+                if schema != self._stream[2]:
+                    self._widenStream(schema)
+                table = table.cast(schema)
+            f, writer, _ = self._stream
+            writer.write_table(table)
+            f.flush()
+        self._spilled += self._n
+        self._n = 0
+
+    def close(self):
+        # End of run: flush, and for Parquet write spill_path from the stream. No collect after this.
+        self.flush()
+        if self._stream is not None:
+            self._closed = True
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+            f, writer, _ = self._stream
+            writer.close()
+            f.close()
+            self._stream = None
+            with pa.OSFile(self._streamPath) as src:
+                reader = pa.ipc.open_stream(src)
+                with pq.ParquetWriter(self.spill_path, reader.schema) as out:
+                    for batch in reader:
+                        out.write_batch(batch)
+            os.remove(self._streamPath)
+            self._streamPath = None
+
+    def _read_spilled_table(self, columns=None):
+        if self.spill_format == "csv":
+            import pandas as pd
+            return pd.read_csv(self.spill_path, usecols=columns)
+        import pyarrow as pa
+        if self._streamPath is not None:
+            with pa.OSFile(self._streamPath) as src:
+                table = pa.ipc.open_stream(src).read_all()
+            if columns is not None:
+                table = table.select(columns)
+        else:
+            import pyarrow.parquet as pq
+            table = pq.read_table(self.spill_path, columns=columns)
+        return table.to_pandas()
+
+    def _read_spilled(self, name):
+        return self._read_spilled_table([name])[name].to_numpy()
+
+    def get_model_vars_dataframe(self):
+        # Spilled rows plus the in-memory ones; the collector keeps collecting afterwards
+        import pandas as pd
+        df = pd.DataFrame(self._columns())
+        if self._spilled:
+            df = pd.concat([self._read_spilled_table(), df], ignore_index=True)
+        return df.set_index("Step")
@@ -0,0 +1,118 @@
+"""
+Geometry helpers for the mine-clearing robots.
+
+The scalar functions work on plain floats (math.atan2 and squared distance
+comparisons) because the robots call them on single points thousands of times per step,
+where the overhead of building NumPy arrays dominates. `position_blocked` is the batched
+counterpart: it tests candidate positions against every robot and obstacle at once.
+"""
+
+import math
+import random
+
+import numpy as np
+
+
+def move(x, y, speed, angle):
+    return x + speed * math.cos(angle), y + speed * math.sin(angle)
+
+
+def go_to(x, y, speed, dest_x, dest_y, rng=random):
+    dx = dest_x - x
+    dy = dest_y - y
+    if dx * dx + dy * dy < speed * speed:
+        return (dest_x, dest_y), 2 * math.pi * rng.random()
+    angle = math.atan2(dy, dx)
+    return move(x, y, speed, angle), angle
+
+
+def dist2(x1, y1, x2, y2):
+    return (x1 - x2) ** 2 + (y1 - y2) ** 2
+
+
+def within(x1, y1, x2, y2, r):
+    return (x1 - x2) ** 2 + (y1 - y2) ** 2 <= r * r
+
+
+def position_blocked(newx, newy, x, y, sight_distance, robots_x, robots_y, robots_speed,
+                     obstacles_x, obstacles_y, obstacles_r):
+    """
+    Vectorized version of Robot.PossibleNextPosition (negated, without the border check) for a
+    robot at (x, y) moving to (newx, newy). The robot arrays must not contain the moving robot
+    itself. newx/newy can also be arrays of candidate positions, one result is returned per
+    candidate.
+    """
+    newx = np.asarray(newx, dtype=float)[..., None]
+    newy = np.asarray(newy, dtype=float)[..., None]
+    near = (robots_x - x) ** 2 + (robots_y - y) ** 2 <= sight_distance ** 2
+    rx, ry = robots_x[near], robots_y[near]
+    blocked = np.any((rx - newx) ** 2 + (ry - newy) ** 2 <= robots_speed[near] ** 2, axis=-1)
+    blocked |= np.any((obstacles_x - newx) ** 2 + (obstacles_y - newy) ** 2 <= obstacles_r ** 2, axis=-1)
+    return blocked if blocked.ndim else bool(blocked)
+
+
+def blocked_arc(x, y, step, cx, cy, r):
+    """
+    Headings for which a move of length `step` from (x, y) ends within r of (cx, cy),
+    as (center, half_width), or None when no heading is blocked.
+    """
+    d = math.hypot(cx - x, cy - y)
+    if d == 0:
+        return (0.0, math.pi) if step <= r else None
+    c = (step * step + d * d - r * r) / (2 * step * d)
+    if c > 1:
+        return None
+    if c <= -1:
+        return 0.0, math.pi
+    return math.atan2(cy - y, cx - x), math.acos(c)
+
+
+def border_arcs(x, y, step, width, height):
+    # Headings leaving [0, width) x [0, height), one arc per side
+    arcs = []
+    for pos, size, center in ((x, width, 0.0), (y, height, math.pi / 2)):
+        low = -pos / step  # cos(heading - center) < low leaves through the lower side
+        if low > 1:
+            return [(0.0, math.pi)]
+        if low > -1:
+            arcs.append((center + math.pi, math.pi - math.acos(low)))
+        high = (size - pos) / step  # cos(heading - center) >= high leaves through the upper side
+        if high <= -1:
+            return [(0.0, math.pi)]
+        if high <= 1:
+            arcs.append((center, math.acos(high)))
+    return arcs
+
+
+def free_headings(arcs):
+    # Complement in [0, 2pi) of the union of blocked arcs, as sorted (start, end) intervals
+    intervals = []
+    for center, half in arcs:
+        if half >= math.pi:
+            return []
+        start = (center - half) % (2 * math.pi)
+        end = start + 2 * half
+        if end > 2 * math.pi:
+            intervals += [(start, 2 * math.pi), (0.0, end - 2 * math.pi)]
+        else:
+            intervals.append((start, end))
+    intervals.sort()
+    free = []
+    current = 0.0
+    for start, end in intervals:
+        if start > current:
+            free.append((current, start))
+        current = max(current, end)
+    if current < 2 * math.pi:
+        free.append((current, 2 * math.pi))
+    return free
+
+
+def random_heading(free, u):
+    # Heading drawn uniformly over the free intervals, u uniform in [0, 1)
+    t = u * sum(end - start for start, end in free)
+    for start, end in free:
+        if t <= end - start:
+            return start + t
+        t -= end - start
+    return free[-1][1]
@@ -0,0 +1,63 @@
+var HistoryChartModule = function(series, canvas_width, canvas_height) {
+	// Same chart as mesa's ChartModule, but each frame carries every row collected since the
+	// previous one ({start, rows}), so no point is lost when the server skips frames.
+	var canvas_tag = "<canvas width='" + canvas_width + "' height='" + canvas_height + "' ";
+	canvas_tag += "style='border:1px dotted'></canvas>";
+	var canvas = $(canvas_tag)[0];
+	$("#elements").append(canvas);
+	var context = canvas.getContext("2d");
+
+	var convertColorOpacity = function(hex) {
+		if (hex.indexOf('#') != 0)
+			return 'rgba(0,0,0,0.1)';
+		hex = hex.replace('#', '');
+		var r = parseInt(hex.substring(0, 2), 16);
+		var g = parseInt(hex.substring(2, 4), 16);
+		var b = parseInt(hex.substring(4, 6), 16);
+		return 'rgba(' + r + ',' + g + ',' + b + ',0.1)';
+	};
+
+	var datasets = [];
+	for (var i in series) {
+		datasets.push({
+			label: series[i].Label,
+			borderColor: series[i].Color,
+			backgroundColor: convertColorOpacity(series[i].Color),
+			pointRadius: 0,
+			data: []
+		});
+	}
+
+	var chart = new Chart(context, {
+		type: 'line',
+		data: {labels: [], datasets: datasets},
+		options: {
+			responsive: true,
+			animation: false,
+			tooltips: {mode: 'index', intersect: false},
+			hover: {mode: 'nearest', intersect: true},
+			scales: {
+				xAxes: [{display: true, scaleLabel: {display: true}, ticks: {maxTicksLimit: 11}}],
+				yAxes: [{display: true, scaleLabel: {display: true}}]
+			}
+		}
+	});
+
+	this.render = function(data) {
+		for (var r = 0; r < data.rows.length; r++) {
+			chart.data.labels.push(data.start + r);
+			for (var i = 0; i < data.rows[r].length; i++)
+				chart.data.datasets[i].data.push(data.rows[r][i]);
+		}
+		if (data.rows.length)
+			chart.update();
+	};
+
+	this.reset = function() {
+		chart.data.labels.length = 0;
+		chart.data.datasets.forEach(function(dataset) {
+			dataset.data.length = 0;
+		});
+		chart.update();
+	};
+};
@@ -1,37 +1,98 @@
 import enum
+import itertools
 import math
-import random
-import uuid
+import multiprocessing
+import time
 from enum import Enum
-import matplotlib.pyplot as plt
 
 import mesa
 import numpy as np
+import pandas as pd
 from collections import defaultdict
 
 import mesa.space
 from mesa import Agent, Model
-from mesa.datacollection import DataCollector
 from mesa.time import RandomActivation
-from mesa.visualization.ModularVisualization import VisualizationElement, ModularServer
-from mesa.visualization.modules import ChartModule
+from mesa.visualization.ModularVisualization import VisualizationElement
+
+from collector import ColumnarDataCollector
+from ids import IdAllocator, model_streams
+from frameserver import FrameServer, HistoryChartModule
+from wire import BinaryFrameEncoder
+from geometry import move, go_to, dist2, within, blocked_arc, border_arcs, free_headings, \
+    random_heading
+from reporting import EndOfRunReporter
 
 MAX_ITERATION = 100
 PROBA_CHGT_ANGLE = 0.01
 
 
-def move(x, y, speed, angle):
-    return x + speed * math.cos(angle), y + speed * math.sin(angle)
-
-
-def go_to(x, y, speed, dest_x, dest_y):
-    if np.linalg.norm((x - dest_x, y - dest_y)) < speed:
-        return (dest_x, dest_y), 2 * math.pi * random.random()
-    else:
-        angle = math.acos((dest_x - x)/np.linalg.norm((x - dest_x, y - dest_y)))
-        if dest_y < y:
-            angle = - angle
-        return move(x, y, speed, angle), angle
+class SpatialIndex:
+    # Uniform grid over objects with x/y attributes. Queries return matches in insertion order,
+    # so code that used to scan a list keeps picking the same element first.
+    def __init__(self, cell_size):
+        self.cell_size = cell_size
+        self.cells = defaultdict(dict)
+        self.cellOf = {}
+        self.seq = {}
+        self.nextSeq = 0
+
+    def __len__(self):
+        return len(self.cellOf)
+
+    def cell(self, x, y):
+        return int(x // self.cell_size), int(y // self.cell_size)
+
+    def insert(self, obj):
+        c = self.cell(obj.x, obj.y)
+        self.cells[c][obj] = None
+        self.cellOf[obj] = c
+        self.seq[obj] = self.nextSeq
+        self.nextSeq += 1
+
+    def remove(self, obj):
+        c = self.cellOf.pop(obj)
+        del self.seq[obj]
+        del self.cells[c][obj]
+        if not self.cells[c]:
+            del self.cells[c]
+
+    def move(self, obj, x, y):
+        obj.x = x
+        obj.y = y
+        c = self.cell(x, y)
+        old = self.cellOf[obj]
+        if c != old:
+            del self.cells[old][obj]
+            if not self.cells[old]:
+                del self.cells[old]
+            self.cells[c][obj] = None
+            self.cellOf[obj] = c
+
+    def candidates(self, x, y, r):
+        cx0, cy0 = self.cell(x - r, y - r)
+        cx1, cy1 = self.cell(x + r, y + r)
+        found = []
+        for cx in range(cx0, cx1 + 1):
+            for cy in range(cy0, cy1 + 1):
+                bucket = self.cells.get((cx, cy))
+                if bucket:
+                    found.extend(bucket)
+        return found
+
+    def query(self, x, y, r):
+        found = [o for o in self.candidates(x, y, r) if within(o.x, o.y, x, y, r)]
+        found.sort(key=self.seq.__getitem__)
+        return found
+
+    def at(self, x, y, eps=1e-3):
+        found = [o for o in self.candidates(x, y, eps) if abs(o.x - x) < eps and abs(o.y - y) < eps]
+        found.sort(key=self.seq.__getitem__)
+        return found
+
+    def covering(self, x, y, max_r):
+        # Objects whose own radius r contains (x, y)
+        return [o for o in self.candidates(x, y, max_r) if within(o.x, o.y, x, y, o.r)]
 
 
 class MarkerPurpose(Enum):
@@ -44,12 +105,21 @@ class ContinuousCanvas(VisualizationElement):
         "./js/simple_continuous_canvas.js",
     ]
 
+    dynamic_keys = ("x", "y", "angle")
+
     def __init__(self, canvas_height=500,
-                 canvas_width=500, instantiate=True):
+                 canvas_width=500, instantiate=True, delta=False, binary=False):
         VisualizationElement.__init__(self)
         self.canvas_height = canvas_height
         self.canvas_width = canvas_width
         self.identifier = "space-canvas"
+        if delta and binary:
+            raise ValueError("delta and binary frames are exclusive")
+        self.delta = delta
+        self.binary = binary
+        self.encoder = BinaryFrameEncoder()
+        self.model = None
+        self.staticModel = None
         if (instantiate):
             new_element = ("new Simple_Continuous_Module({}, {},'{}')".
                            format(self.canvas_width, self.canvas_height, self.identifier))
@@ -58,50 +128,88 @@ class ContinuousCanvas(VisualizationElement):
     def portrayal_method(self, obj):
         return obj.portrayal_method()
 
-    def render(self, model):
+    def portray(self, model, obj):
+        portrayal = self.portrayal_method(obj)
+        if portrayal:
+            portrayal["x"] = ((obj.x - model.space.x_min) /
+                              (model.space.x_max - model.space.x_min))
+            portrayal["y"] = ((obj.y - model.space.y_min) /
+                              (model.space.y_max - model.space.y_min))
+        return portrayal
+
+    def portrayals(self, model):
+        for objects in (model.schedule.agents, model.mines, model.markers):
+            for obj in objects:
+                yield obj, self.portray(model, obj)
+
+    def static_layers(self, model):
+        # Obstacles and quicksands never move after MinedZone.__init__: they are sent once per
+        # model instance and the client keeps them in an offscreen background canvas.
+        if model is self.staticModel:
+            return None
+        self.staticModel = model
         representation = defaultdict(list)
-        for obj in model.schedule.agents:
-            portrayal = self.portrayal_method(obj)
-            if portrayal:
-                portrayal["x"] = ((obj.x - model.space.x_min) /
-                                  (model.space.x_max - model.space.x_min))
-                portrayal["y"] = ((obj.y - model.space.y_min) /
-                                  (model.space.y_max - model.space.y_min))
-            representation[portrayal["Layer"]].append(portrayal)
-        for obj in model.mines:
-            portrayal = self.portrayal_method(obj)
-            if portrayal:
-                portrayal["x"] = ((obj.x - model.space.x_min) /
-                                  (model.space.x_max - model.space.x_min))
-                portrayal["y"] = ((obj.y - model.space.y_min) /
-                                  (model.space.y_max - model.space.y_min))
-            representation[portrayal["Layer"]].append(portrayal)
-        for obj in model.markers:
-            portrayal = self.portrayal_method(obj)
-            if portrayal:
-                portrayal["x"] = ((obj.x - model.space.x_min) /
-                                  (model.space.x_max - model.space.x_min))
-                portrayal["y"] = ((obj.y - model.space.y_min) /
-                                  (model.space.y_max - model.space.y_min))
-            representation[portrayal["Layer"]].append(portrayal)
-        for obj in model.obstacles:
-            portrayal = self.portrayal_method(obj)
-            if portrayal:
-                portrayal["x"] = ((obj.x - model.space.x_min) /
-                                  (model.space.x_max - model.space.x_min))
-                portrayal["y"] = ((obj.y - model.space.y_min) /
-                                  (model.space.y_max - model.space.y_min))
-            representation[portrayal["Layer"]].append(portrayal)
-        for obj in model.quicksands:
-            portrayal = self.portrayal_method(obj)
-            if portrayal:
-                portrayal["x"] = ((obj.x - model.space.x_min) /
-                                  (model.space.x_max - model.space.x_min))
-                portrayal["y"] = ((obj.y - model.space.y_min) /
-                                  (model.space.y_max - model.space.y_min))
-            representation[portrayal["Layer"]].append(portrayal)
+        for objects in (model.obstacles, model.quicksands):
+            for obj in objects:
+                portrayal = self.portray(model, obj)
+                representation[portrayal["Layer"]].append(portrayal)
         return representation
 
+    def render(self, model):
+        static = self.static_layers(model)
+        if self.binary:
+            representation = self.encoder.encode(model, (p for _, p in self.portrayals(model)))
+        elif self.delta:
+            representation = self.render_delta(model)
+        else:
+            representation = defaultdict(list)
+            for _, portrayal in self.portrayals(model):
+                representation[portrayal["Layer"]].append(portrayal)
+        if static is not None:
+            representation["static"] = static
+        return representation
+
+    def render_delta(self, model):
+        # Each drawn object gets a small handle. Its style (everything but x, y, angle) is sent
+        # once as an index into a palette, then only handles whose position changed are sent.
+        reset = model is not self.model
+        if reset:
+            self.model = model
+            self.handles = {}
+            self.sent = {}
+            self.styles = {}
+            self.nextHandle = 0
+        frame = {"delta": True, "reset": reset, "styles": {}, "set": [],
+                 "ids": [], "x": [], "y": [], "a": [], "removed": []}
+        seen = set()
+        for key, portrayal in self.portrayals(model):
+            h = self.handles.get(key)
+            if h is None:
+                h = self.handles[key] = self.nextHandle
+                self.nextHandle += 1
+            seen.add(h)
+            style = tuple(sorted((k, v) for k, v in portrayal.items() if k not in self.dynamic_keys))
+            s = self.styles.get(style)
+            if s is None:
+                s = self.styles[style] = len(self.styles)
+                frame["styles"][s] = dict(style)
+            pos = (portrayal["x"], portrayal["y"], portrayal.get("angle", 0))
+            old = self.sent.get(h)
+            if old is None or old[0] != s:
+                frame["set"] += (h, s)
+            if old is None or old[1] != pos:
+                frame["ids"].append(h)
+                frame["x"].append(pos[0])
+                frame["y"].append(pos[1])
+                frame["a"].append(pos[2])
+            self.sent[h] = (s, pos)
+        for key, h in list(self.handles.items()):
+            if h not in seen:
+                del self.handles[key]
+                del self.sent[h]
+                frame["removed"].append(h)
+        return frame
+
 
 class Obstacle:  # Environnement: obstacle infranchissable
     def __init__(self, x, y, r):
@@ -179,34 +287,53 @@ class Robot(Agent):  # La classe des agents
         self.counter = 0
 
     def ChangeRandomAngle(self):
-        self.angle = random.random() * 2 * math.pi
+        self.angle = self.random.random() * 2 * math.pi
 
     def intersect(self, other, newx, newy):
-        return np.linalg.norm((newx - other.x,newy-other.y))<=other.speed or np.linalg.norm((self.x - other.x,self.y-other.y))<=other.speed
+        # A robot already within other.speed of other may still move out of that radius, otherwise
+        # two robots that end up that close (after a slowed move) would block each other for good
+        return within(newx, newy, other.x, other.y, other.speed)
 
 
     def PossibleNextPosition(self, newx, newy):
         if(newx<0 or newy<0 or newx>=500 or newy>=500):
             return False
-        cond=True
-        for robot in self.model.schedule.agent_buffer() : 
-            if robot ==self : 
+        for robot in self.model.robotIndex.query(self.x, self.y, self.sight_distance) :
+            if robot !=self and self.intersect(robot, newx, newy):
+                return False
+        if self.model.obstacleIndex.covering(newx, newy, self.model.maxObstacleRadius) :
+            return False
+        return True
+
+    def escapeHeading(self, speed):
+        # Random heading among those for which PossibleNextPosition holds, computed from the
+        # nearby blockers instead of drawing angles until one works. None when boxed in.
+        arcs = border_arcs(self.x, self.y, speed, 500, 500)
+        for robot in self.model.robotIndex.query(self.x, self.y, self.sight_distance) :
+            if robot == self :
                 continue
-            if(np.linalg.norm((self.x - robot.x,self.y-robot.y))<=self.sight_distance and self.intersect(robot, newx, newy)):
-                cond=False
-                break
-        for obs in self.model.obstacles : 
-            if(np.linalg.norm((newx - obs.x,newy-obs.y))<=obs.r) : 
-                cond=False
-                break
-        return cond
+            arcs.append(blocked_arc(self.x, self.y, speed, robot.x, robot.y, robot.speed))
+        for obs in self.model.obstacleIndex.candidates(self.x, self.y, speed + self.model.maxObstacleRadius) :
+            arcs.append(blocked_arc(self.x, self.y, speed, obs.x, obs.y, obs.r))
+        free = free_headings([a for a in arcs if a is not None])
+        for _ in range(3) :
+            if not free :
+                return None
+            angle = random_heading(free, self.random.random())
+            if self.PossibleNextPosition(*move(self.x, self.y, speed, angle)) :
+                return angle
+        return None
+
+    def moveTo(self, x, y):
+        self.model.robotIndex.move(self, x, y)
+
     def  putDangerMarker(self):
-        self.model.markers.append(Marker(self.x, self.y,MarkerPurpose.DANGER))
+        self.model.addMarker(Marker(self.x, self.y,MarkerPurpose.DANGER))
         
 
     def putIndicationMarkers(self, positions):
         for (x,y) in positions : 
-            self.model.markers.append(Marker(x, y,MarkerPurpose.INDICATION,self.angle))
+            self.model.addMarker(Marker(x, y,MarkerPurpose.INDICATION,self.angle))
 
     def updCounter(self):
         self.counter=self.speed//2
@@ -214,33 +341,20 @@ class Robot(Agent):  # La classe des agents
     def step(self):
         self.counter = max((self.counter-1,0))
         # Détruire les mines
-        idxToRmv = []
         indicationMarkers = []
-        for (i,mine) in enumerate(self.model.mines) : 
-            if(abs(self.x-mine.x)<1e-3 and abs(self.y-mine.y)<1e-3):
-                idxToRmv.append(i)
-                indicationMarkers.append((mine.x,mine.y))
-                self.updCounter()
-                
-
-        self.model.mines= [self.model.mines[i] for i in range(len(self.model.mines)) if i not in idxToRmv]
-        
-        idxToRmv = []
-        for (i,marker) in enumerate(self.model.markers) : 
-            if(abs(self.x-marker.x)<1e-3 and abs(self.y-marker.y)<1e-3):
-                idxToRmv.append(i)
-        self.model.markers= [self.model.markers[i] for i in range(len(self.model.markers)) if i not in idxToRmv]
-                
+        for mine in self.model.mineIndex.at(self.x, self.y) :
+            indicationMarkers.append((mine.x,mine.y))
+            self.updCounter()
+            self.model.removeMine(mine)
 
-        self.model.mines= [self.model.mines[i] for i in range(len(self.model.mines)) if i not in idxToRmv]
+        for marker in self.model.markerIndex.at(self.x, self.y) :
+            self.model.removeMarker(marker)
         
         # Diminuer la vitesse s'il trouve dans un environnement ralentissant
         speed  = self.speed
-        for ralent in self.model.quicksands : 
-            
-            if np.linalg.norm((self.x - ralent.x,self.y-ralent.y)) <=ralent.r :
-                speed = speed / 2 
-                self.model.quicksandsCounter += 1
+        for ralent in self.model.quicksandIndex.covering(self.x, self.y, self.model.maxQuicksandRadius) :
+            speed = speed / 2 
+            self.model.quicksandsCounter += 1
                 
         
 
@@ -249,52 +363,50 @@ class Robot(Agent):  # La classe des agents
             self.updCounter()
         self.lastspeed = speed
         # changement de l'angle aléatoirement
-        if random.random() <= PROBA_CHGT_ANGLE : 
+        if self.random.random() <= PROBA_CHGT_ANGLE : 
             self.ChangeRandomAngle()
         
         # Détecter les mines
-        for mine in  self.model.mines : 
-            if np.linalg.norm((self.x - mine.x,self.y-mine.y)) <=self.sight_distance  : 
-                (newx , newy) , angle = go_to(self.x, self.y, speed, mine.x, mine.y)
-                if self.PossibleNextPosition(newx,newy)  : 
-                    self.x = newx
-                    self.y = newy
-                    self.angle = angle 
-                    self.putIndicationMarkers(indicationMarkers)
-                    return
-        if(self.counter>0):
-            print(self.counter)
+        for mine in  self.model.mineIndex.query(self.x, self.y, self.sight_distance) : 
+            (newx , newy) , angle = go_to(self.x, self.y, speed, mine.x, mine.y, self.random)
+            if self.PossibleNextPosition(newx,newy)  : 
+                self.moveTo(newx, newy)
+                self.angle = angle 
+                self.putIndicationMarkers(indicationMarkers)
+                return
         if(self.counter==0):
             idxToRmv = []
-            for marker in  self.model.markers : 
-                if np.linalg.norm((self.x - marker.x,self.y-marker.y)) <=self.sight_distance  : 
-                    (newx , newy) , angle = go_to(self.x, self.y, speed, marker.x, marker.y)
-                    if self.PossibleNextPosition(newx,newy)  : 
-                        if(marker.purpose==MarkerPurpose.INDICATION):
-                            self.x = newx
-                            self.y = newy
-                            r = random.random()
-                            r = int (r>0.5)
-                            if r==0:
-                                r=-1
-                            self.angle = angle + r*math.pi/2 
-                            self.angle%=math.pi
-                            self.putIndicationMarkers(indicationMarkers)
-                            return
-                        else : 
-                            self.x = newx
-                            self.y = newy
-                            self.angle = -angle
-                            while self.angle<0: 
-                                self.angle+=2*math.pi
-                            self.putIndicationMarkers(indicationMarkers)
-                            return
+            for marker in  self.model.markerIndex.query(self.x, self.y, self.sight_distance) : 
+                (newx , newy) , angle = go_to(self.x, self.y, speed, marker.x, marker.y, self.random)
+                if self.PossibleNextPosition(newx,newy)  : 
+                    if(marker.purpose==MarkerPurpose.INDICATION):
+                        self.moveTo(newx, newy)
+                        r = self.random.random()
+                        r = int (r>0.5)
+                        if r==0:
+                            r=-1
+                        self.angle = angle + r*math.pi/2 
+                        self.angle%=math.pi
+                        self.putIndicationMarkers(indicationMarkers)
+                        return
+                    else : 
+                        self.moveTo(newx, newy)
+                        self.angle = -angle
+                        while self.angle<0: 
+                            self.angle+=2*math.pi
+                        self.putIndicationMarkers(indicationMarkers)
+                        return
         newx , newy = move(self.x, self.y, self.speed, self.angle)
-        while not self.PossibleNextPosition(newx,newy):
-            self.ChangeRandomAngle()
-            newx , newy = move(self.x, self.y, speed, self.angle)
-
-        self.x , self.y = move(self.x, self.y, speed, self.angle)
+        if not self.PossibleNextPosition(newx,newy):
+            angle = self.escapeHeading(speed)
+            if angle is None :
+                # Boxed in: stay put this step
+                self.model.collisionFallbacks += 1
+                self.putIndicationMarkers(indicationMarkers)
+                return
+            self.angle = angle
+
+        self.moveTo(*move(self.x, self.y, speed, self.angle))
         self.putIndicationMarkers(indicationMarkers)
          
     def portrayal_method(self):
@@ -303,66 +415,352 @@ class Robot(Agent):  # La classe des agents
         return portrayal
 
 
+def near(ax, ay, bx, by, r):
+    # Boolean matrix [i, j]: point j of b is within r of point i of a (r scalar or per-column)
+    return (ax[:, None] - bx[None, :]) ** 2 + (ay[:, None] - by[None, :]) ** 2 <= np.square(r)
+
+
+def pairs_within(src_x, src_y, dst_x, dst_y, r):
+    # Index pairs (i_src, i_dst) closer than r, found by binning sources in cells of size r
+    # so that only the 3x3 neighbouring cells of each destination are compared.
+    if len(src_x) == 0 or len(dst_x) == 0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    scx = (src_x // r).astype(np.int64) + 1
+    scy = (src_y // r).astype(np.int64) + 1
+    dcx = (dst_x // r).astype(np.int64) + 1
+    dcy = (dst_y // r).astype(np.int64) + 1
+    k = max(scy.max(), dcy.max()) + 2
+    order = np.argsort(scx * k + scy, kind="stable")
+    skeys = (scx * k + scy)[order]
+    srcIdx, dstIdx = [], []
+    for ox in (-1, 0, 1):
+        for oy in (-1, 0, 1):
+            keys = (dcx + ox) * k + (dcy + oy)
+            lo = np.searchsorted(skeys, keys, "left")
+            cnt = np.searchsorted(skeys, keys, "right") - lo
+            total = cnt.sum()
+            if total == 0:
+                continue
+            d = np.repeat(np.arange(len(keys)), cnt)
+            s = order[np.repeat(lo - np.cumsum(cnt) + cnt, cnt) + np.arange(total)]
+            close = (src_x[s] - dst_x[d]) ** 2 + (src_y[s] - dst_y[d]) ** 2 <= r * r
+            srcIdx.append(s[close])
+            dstIdx.append(d[close])
+    if not srcIdx:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    return np.concatenate(srcIdx), np.concatenate(dstIdx)
+
+
+class ArraySwarm:
+    # Array-backed execution of Robot.step for the whole swarm. Pickup, quicksand slowdown,
+    # danger markers and random heading changes are computed for every robot at once, and the
+    # mines/markers in sight come from pairs_within. Every robot's move is then proposed at once
+    # against the border and the obstacles. Proposals that cannot meet another robot, whatever
+    # order the robots move in, are accepted together; the other robots move one by one in a
+    # random order, so their collisions are checked against up-to-date positions.
+    # MinedZone's robots, mines and markers are kept in sync for rendering and reporting.
+    def __init__(self, model):
+        self.model = model
+        self.robots = list(model.schedule.agents)
+        self.x = np.array([r.x for r in self.robots], dtype=float)
+        self.y = np.array([r.y for r in self.robots], dtype=float)
+        self.angle = np.array([r.angle for r in self.robots], dtype=float)
+        self.speed = np.array([r.speed for r in self.robots], dtype=float)
+        self.sight = np.array([r.sight_distance for r in self.robots], dtype=float)
+        self.counter = np.array([r.counter for r in self.robots], dtype=int)
+        self.lastspeed = np.array([r.lastspeed for r in self.robots], dtype=float)
+        self.ox = np.array([o.x for o in model.obstacles], dtype=float)
+        self.oy = np.array([o.y for o in model.obstacles], dtype=float)
+        self.orad = np.array([o.r for o in model.obstacles], dtype=float)
+        self.qx = np.array([q.x for q in model.quicksands], dtype=float)
+        self.qy = np.array([q.y for q in model.quicksands], dtype=float)
+        self.qr = np.array([q.r for q in model.quicksands], dtype=float)
+        self.mines = list(model.mines)
+        self.mx = np.array([m.x for m in self.mines], dtype=float)
+        self.my = np.array([m.y for m in self.mines], dtype=float)
+        self.mineAlive = np.ones(len(self.mines), dtype=bool)
+        self.markers = list(model.markers)
+        self.kx = np.array([m.x for m in self.markers], dtype=float)
+        self.ky = np.array([m.y for m in self.markers], dtype=float)
+        self.kdanger = np.array([m.purpose == MarkerPurpose.DANGER for m in self.markers], dtype=bool)
+        self.kAlive = np.ones(len(self.markers), dtype=bool)
+
+    def under(self, r, j, px, py):
+        # Flags the (robot, point) pairs where the robot stands on the point
+        return (np.abs(self.x[r] - px[j]) < 1e-3) & (np.abs(self.y[r] - py[j]) < 1e-3)
+
+    def seen(self, px, py, alive):
+        # (robot, point) index pairs of alive points in sight of each robot, sorted by robot then point
+        live = np.flatnonzero(alive)
+        j, r = pairs_within(px[live], py[live], self.x, self.y, self.sight.max())
+        j = live[j]
+        keep = (px[j] - self.x[r]) ** 2 + (py[j] - self.y[r]) ** 2 <= self.sight[r] ** 2
+        order = np.lexsort((j[keep], r[keep]))
+        return r[keep][order], j[keep][order]
+
+    def open(self, newx, newy):
+        # Border and obstacle part of feasible, one flag per position
+        inside = (newx >= 0) & (newy >= 0) & (newx < 500) & (newy < 500)
+        hit = (self.ox - newx[:, None]) ** 2 + (self.oy - newy[:, None]) ** 2 <= self.orad ** 2
+        return inside & ~hit.any(axis=1)
+
+    def towards(self, r, targets, tx, ty, speed):
+        # First target (in insertion order) whose go_to position is free, as (j, x, y, angle)
+        for j in targets:
+            (nx, ny), angle = go_to(self.x[r], self.y[r], speed, tx[j], ty[j], self.model.random)
+            if self.robots[r].PossibleNextPosition(nx, ny):
+                return j, nx, ny, angle
+        return None
+
+    def moveRobot(self, r, x, y):
+        self.x[r], self.y[r] = x, y
+        self.model.robotIndex.move(self.robots[r], float(x), float(y))
+
+    def propose(self, pr, pj, tx, ty, speed):
+        # towards() for every (robot, target) pair at once, ignoring the other robots: the first
+        # target of each robot whose go_to position is open, as (robots, targets, x, y, angle)
+        dx = tx[pj] - self.x[pr]
+        dy = ty[pj] - self.y[pr]
+        angle = np.arctan2(dy, dx)
+        close = dx * dx + dy * dy < speed[pr] ** 2
+        nx = np.where(close, tx[pj], self.x[pr] + speed[pr] * np.cos(angle))
+        ny = np.where(close, ty[pj], self.y[pr] + speed[pr] * np.sin(angle))
+        angle = np.where(close, self.model.rng.random(len(pj)) * 2 * math.pi, angle)
+        ok = np.flatnonzero(self.open(nx, ny))
+        first = ok[np.unique(pr[ok], return_index=True)[1]]
+        return pr[first], pj[first], nx[first], ny[first], angle[first]
+
+    def step(self):
+        model = self.model
+        n = len(self.x)
+        self.counter = np.maximum(self.counter - 1, 0)
+
+        # Mines and markers in sight, also used for the pickups below since robots do not move before
+        mineR, mineJ = self.seen(self.mx, self.my, self.mineAlive)
+        markerR, markerJ = self.seen(self.kx, self.ky, self.kAlive)
+
+        # Détruire les mines et ramasser les balises
+        on = self.under(mineR, mineJ, self.mx, self.my)
+        indications = [[] for _ in range(n)]
+        for r, j in zip(mineR[on], mineJ[on]):
+            if self.mineAlive[j]:
+                self.mineAlive[j] = False
+                model.removeMine(self.mines[j])
+                indications[r].append((self.mx[j], self.my[j]))
+        picked = np.zeros(n, dtype=bool)
+        picked[mineR[on]] = True
+        self.counter[picked] = self.speed[picked] // 2
+        for j in np.unique(markerJ[self.under(markerR, markerJ, self.kx, self.ky)]):
+            self.kAlive[j] = False
+            model.removeMarker(self.markers[j])
+        keep = self.mineAlive[mineJ]
+        mineR, mineJ = mineR[keep], mineJ[keep]
+        keep = self.kAlive[markerJ]
+        markerR, markerJ = markerR[keep], markerJ[keep]
+
+        # Ralentissement dans les sables mouvants
+        k = near(self.x, self.y, self.qx, self.qy, self.qr).sum(axis=1)
+        speed = self.speed / 2.0 ** k
+        model.quicksandsCounter += int(k.sum())
+        newMarkers = []
+        for r in np.flatnonzero((k == 0) & (self.lastspeed != self.speed)):
+            newMarkers.append(Marker(self.x[r], self.y[r], MarkerPurpose.DANGER))
+            self.counter[r] = self.speed[r] // 2
+        self.lastspeed = speed
+
+        change = self.model.rng.random(n) <= PROBA_CHGT_ANGLE
+        self.angle[change] = self.model.rng.random(np.count_nonzero(change)) * 2 * math.pi
+
+        mineBounds = np.searchsorted(mineR, np.arange(n + 1))
+        markerBounds = np.searchsorted(markerR, np.arange(n + 1))
+
+        # Proposed moves: mine, then marker, then current heading, tested against border and obstacles
+        newx, newy, newangle = self.x.copy(), self.y.copy(), self.angle.copy()
+        pending = np.ones(n, dtype=bool)
+        r, _, newx_r, newy_r, angle = self.propose(mineR, mineJ, self.mx, self.my, speed)
+        newx[r], newy[r], newangle[r] = newx_r, newy_r, angle
+        pending[r] = False
+        sel = pending[markerR] & (self.counter[markerR] == 0)
+        r, j, newx_r, newy_r, angle = self.propose(markerR[sel], markerJ[sel], self.kx, self.ky, speed)
+        newx[r], newy[r] = newx_r, newy_r
+        turn = np.where(self.model.rng.random(len(r)) > 0.5, 1, -1)
+        newangle[r] = np.where(self.kdanger[j], (-angle) % (2 * math.pi), (angle + turn * math.pi / 2) % math.pi)
+        pending[r] = False
+        testx, testy = newx.copy(), newy.copy()
+        r = np.flatnonzero(pending)
+        cos, sin = np.cos(self.angle[r]), np.sin(self.angle[r])
+        ok = self.open(self.x[r] + self.speed[r] * cos, self.y[r] + self.speed[r] * sin)
+        r, cos, sin = r[ok], cos[ok], sin[ok]
+        testx[r], testy[r] = self.x[r] + self.speed[r] * cos, self.y[r] + self.speed[r] * sin
+        newx[r], newy[r] = self.x[r] + speed[r] * cos, self.y[r] + speed[r] * sin
+        pending[r] = False
+
+        # A proposal is accepted when its tested position is not within speed of another robot's
+        # current or new position; the rest goes through the sequential pass
+        bx, by = np.concatenate((self.x, newx)), np.concatenate((self.y, newy))
+        b, a = pairs_within(bx, by, testx, testy, self.speed.max())
+        hit = (a != b % n) & ((bx[b] - testx[a]) ** 2 + (by[b] - testy[a]) ** 2 <= self.speed[b % n] ** 2)
+        pending[a[hit]] = True
+        for r in np.flatnonzero(~pending):
+            self.moveRobot(r, newx[r], newy[r])
+            self.angle[r] = newangle[r]
+
+        # Sequential pass with the robots' own scalar checks, against up-to-date positions
+        for r in self.model.rng.permutation(np.flatnonzero(pending)):
+            robot = self.robots[r]
+            found = self.towards(r, mineJ[mineBounds[r]:mineBounds[r + 1]], self.mx, self.my, speed[r])
+            if found is not None:
+                _, x, y, self.angle[r] = found
+                self.moveRobot(r, x, y)
+            elif self.counter[r] == 0:
+                found = self.towards(r, markerJ[markerBounds[r]:markerBounds[r + 1]], self.kx, self.ky, speed[r])
+                if found is not None:
+                    j, x, y, angle = found
+                    self.moveRobot(r, x, y)
+                    if self.kdanger[j]:
+                        self.angle[r] = (-angle) % (2 * math.pi)
+                    else:
+                        self.angle[r] = (angle + (1 if self.model.rng.random() > 0.5 else -1) * math.pi / 2) % math.pi
+            if found is None:
+                # Current heading, else the robot's own escape heading (its x/y follow moveRobot)
+                if not robot.PossibleNextPosition(*move(self.x[r], self.y[r], self.speed[r], self.angle[r])):
+                    angle = robot.escapeHeading(speed[r])
+                    if angle is None:
+                        # Boxed in: stay put this step
+                        model.collisionFallbacks += 1
+                        continue
+                    self.angle[r] = angle
+                self.moveRobot(r, *move(self.x[r], self.y[r], speed[r], self.angle[r]))
+        for r in range(n):
+            for (x, y) in indications[r]:
+                newMarkers.append(Marker(x, y, MarkerPurpose.INDICATION, self.angle[r]))
+
+        for marker in newMarkers:
+            model.addMarker(marker)
+        self.markers += newMarkers
+        self.kx = np.append(self.kx, [m.x for m in newMarkers])
+        self.ky = np.append(self.ky, [m.y for m in newMarkers])
+        self.kdanger = np.append(self.kdanger, [m.purpose == MarkerPurpose.DANGER for m in newMarkers])
+        self.kAlive = np.append(self.kAlive, np.ones(len(newMarkers), dtype=bool))
+        if np.count_nonzero(~self.kAlive) > len(self.kAlive) // 2:
+            self.markers = [m for m, alive in zip(self.markers, self.kAlive) if alive]
+            self.kx, self.ky, self.kdanger = self.kx[self.kAlive], self.ky[self.kAlive], self.kdanger[self.kAlive]
+            self.kAlive = np.ones(len(self.markers), dtype=bool)
+
+        for i, robot in enumerate(self.robots):
+            robot.angle = float(self.angle[i])
+            robot.counter = int(self.counter[i])
+            robot.lastspeed = float(self.lastspeed[i])
+
+
 class MinedZone(Model):
-    collector = DataCollector(
-        model_reporters={"Mines": lambda model: len(model.mines),
-                         "Danger markers": lambda model: len([m for m in model.markers if
-                                                          m.purpose == MarkerPurpose.DANGER]),
-                         "Indication markers": lambda model: len([m for m in model.markers if
-                                                          m.purpose == MarkerPurpose.INDICATION]),
-                         "Steps in quickSand": lambda model : model.quicksandsCounter,},
-        agent_reporters={})
-
-    def __init__(self, n_robots, n_obstacles, n_quicksand, n_mines, speed):
+    model_reporters = {"Mines": lambda model: len(model.mines),
+                       "Danger markers": lambda model: model.markerCounts[MarkerPurpose.DANGER],
+                       "Indication markers": lambda model: model.markerCounts[MarkerPurpose.INDICATION],
+                       "Steps in quickSand": lambda model : model.quicksandsCounter,
+                       "Collision fallbacks": lambda model : model.collisionFallbacks,}
+
+    def __init__(self, n_robots, n_obstacles, n_quicksand, n_mines, speed, engine="agents", end_of_run_hooks=(),
+                 seed=None, collector_options=None):
         Model.__init__(self)
+        self.rng, self.random = model_streams(seed)
+        self.idAllocator = IdAllocator()
         self.space = mesa.space.ContinuousSpace(600, 600, False)
         self.schedule = RandomActivation(self)
-        self.mines = []  # Access list of mines from robot through self.model.mines
-        self.markers = []  # Access list of markers from robot through self.model.markers (both read and write)
+        # Mines and markers are insertion-ordered dicts used as sets, so a pickup is an O(1) delete
+        self.mines = {}  # Access mines from robot through self.model.mines
+        self.markers = {}  # Access markers from robot through self.model.markers (both read and write)
+        self.markerCounts = {MarkerPurpose.DANGER: 0, MarkerPurpose.INDICATION: 0}
         self.obstacles = []  # Access list of obstacles from robot through self.model.obstacles
         self.quicksands = []  # Access list of quicksands from robot through self.model.quicksands
+        # Spatial indexes used by the robots for every radius or exact-position query
+        self.mineIndex = SpatialIndex(2 * speed)
+        self.markerIndex = SpatialIndex(2 * speed)
+        self.robotIndex = SpatialIndex(2 * speed)
+        self.obstacleIndex = SpatialIndex(30)
+        self.quicksandIndex = SpatialIndex(30)
+        self.maxObstacleRadius = 0
+        self.maxQuicksandRadius = 0
         for _ in range(n_obstacles):
-            self.obstacles.append(Obstacle(random.random() * 500, random.random() * 500, 10 + 20 * random.random()))
+            self.obstacles.append(Obstacle(self.random.random() * 500, self.random.random() * 500, 10 + 20 * self.random.random()))
+            self.obstacleIndex.insert(self.obstacles[-1])
+            self.maxObstacleRadius = max(self.maxObstacleRadius, self.obstacles[-1].r)
         for _ in range(n_quicksand):
-            self.quicksands.append(Quicksand(random.random() * 500, random.random() * 500, 10 + 20 * random.random()))
+            self.quicksands.append(Quicksand(self.random.random() * 500, self.random.random() * 500, 10 + 20 * self.random.random()))
+            self.quicksandIndex.insert(self.quicksands[-1])
+            self.maxQuicksandRadius = max(self.maxQuicksandRadius, self.quicksands[-1].r)
         for _ in range(n_robots):
-            x, y = random.random() * 500, random.random() * 500
-            while [o for o in self.obstacles if np.linalg.norm((o.x - x, o.y - y)) < o.r] or \
-                    [o for o in self.quicksands if np.linalg.norm((o.x - x, o.y - y)) < o.r]:
-                x, y = random.random() * 500, random.random() * 500
-            self.schedule.add(
-                Robot(int(uuid.uuid1()), self, x, y, speed,
-                      2 * speed, random.random() * 2 * math.pi))
+            # Robots start more than `speed` apart, unless the zone is too crowded for it
+            x, y = self.random.random() * 500, self.random.random() * 500
+            tries = 0
+            while self.isBlocked(x, y) or (tries < MAX_ITERATION and self.robotIndex.query(x, y, speed)):
+                x, y = self.random.random() * 500, self.random.random() * 500
+                tries += 1
+            robot = Robot(self.next_id(), self, x, y, speed,
+                          2 * speed, self.random.random() * 2 * math.pi)
+            self.schedule.add(robot)
+            self.robotIndex.insert(robot)
         for _ in range(n_mines):
-            x, y = random.random() * 500, random.random() * 500
-            while [o for o in self.obstacles if np.linalg.norm((o.x - x, o.y - y)) < o.r] or \
-                    [o for o in self.quicksands if np.linalg.norm((o.x - x, o.y - y)) < o.r]:
-                x, y = random.random() * 500, random.random() * 500
-            self.mines.append(Mine(x, y))
-        self.datacollector = self.collector
+            x, y = self.random.random() * 500, self.random.random() * 500
+            while self.isBlocked(x, y):
+                x, y = self.random.random() * 500, self.random.random() * 500
+            mine = Mine(x, y)
+            self.mines[mine] = None
+            self.mineIndex.insert(mine)
+        self.datacollector = ColumnarDataCollector(model_reporters=self.model_reporters, agent_reporters={},
+                                                   **(collector_options or {}))
         self.cumulativeMines = [0]
         self.initialCountMines = len(self.mines)
         self.quicksandsCounter = 0
+        self.collisionFallbacks = 0  # robots that stayed put because every heading was blocked, last step
+        self.endOfRunHooks = list(end_of_run_hooks)  # called with the model once the last mine is cleared
+        self.engine = None
+        if engine == "numpy":
+            self.engine = ArraySwarm(self)
+        elif engine != "agents":
+            raise ValueError("Unknown engine " + repr(engine))
+
+    def next_id(self):
+        return self.idAllocator.allocate()
+
+    def isBlocked(self, x, y):
+        return any(dist2(o.x, o.y, x, y) < o.r ** 2 for o in
+                   self.obstacleIndex.candidates(x, y, self.maxObstacleRadius)) or \
+            any(dist2(o.x, o.y, x, y) < o.r ** 2 for o in
+                self.quicksandIndex.candidates(x, y, self.maxQuicksandRadius))
+
+    def addMarker(self, marker):
+        self.markers[marker] = None
+        self.markerIndex.insert(marker)
+        self.markerCounts[marker.purpose] += 1
+
+    def removeMarker(self, marker):
+        del self.markers[marker]
+        self.markerIndex.remove(marker)
+        self.markerCounts[marker.purpose] -= 1
+
+    def removeMine(self, mine):
+        del self.mines[mine]
+        self.mineIndex.remove(mine)
 
     def step(self):
         self.datacollector.collect(self)
-        self.schedule.step()
+        self.collisionFallbacks = 0
+        if self.engine is not None:
+            self.engine.step()
+            self.schedule.steps += 1
+            self.schedule.time += 1
+        else:
+            self.schedule.step()
         self.cumulativeMines.append(self.initialCountMines-len(self.mines))
         if not self.mines:
-            plt.plot(list(range(len(self.cumulativeMines))),self.cumulativeMines)
-            plt.xlabel("Step")
-            plt.ylabel("Cumulative mines count")
-            plt.savefig('CumulativeMinesCount.png')
-            print("Saved Cumualtive mines count figure ..")
-            f = open("StepCountTillEnd.txt",'a')
-            f.write(str(len(self.cumulativeMines))+"\n")
-            f.close()
-            print("Saved Number of steps ..")
             self.running = False
+            for hook in self.endOfRunHooks:
+                hook(self)
 
 
-def run_single_server():
-    chart = ChartModule([{"Label": "Mines",
+def run_single_server(steps_per_frame=1, free_run=False):
+    chart = HistoryChartModule([{"Label": "Mines",
                           "Color": "Orange"},
                          {"Label": "Danger markers",
                           "Color": "Red"},
@@ -372,11 +770,12 @@ def run_single_server():
                           "Color": "black"}
                          ],
                         data_collector_name='datacollector')
-    server = ModularServer(MinedZone,
-                           [ContinuousCanvas(),
+    server = FrameServer(MinedZone,
+                           [ContinuousCanvas(delta=True),
                             chart],
                            "Deminer robots",
-                           {"n_robots": mesa.visualization.
+                           {"end_of_run_hooks": [EndOfRunReporter(plot_path="CumulativeMinesCount.png")],
+                            "n_robots": mesa.visualization.
                             ModularVisualization.UserSettableParameter('slider', "Number of robots", 7, 3,
                                                                        15, 1),
                             "n_obstacles": mesa.visualization.
@@ -386,10 +785,74 @@ def run_single_server():
                             "speed": mesa.visualization.
                             ModularVisualization.UserSettableParameter('slider', "Robot speed", 15, 5, 40, 5),
                             "n_mines": mesa.visualization.
-                            ModularVisualization.UserSettableParameter('slider', "Number of mines", 15, 5, 30, 1)})
+                            ModularVisualization.UserSettableParameter('slider', "Number of mines", 15, 5, 30, 1)},
+                           steps_per_frame=steps_per_frame, free_run=free_run)
     server.port = 8521
     server.launch()
 
 
+BATCH_COLUMNS = ["Steps", "Cleared", "Mines", "Steps in quickSand", "Danger markers", "Indication markers"]
+
+
+def run_experiment(task):
+    run, params, seed, max_steps = task
+    model = MinedZone(**params, seed=seed)
+    while model.running and model.schedule.steps < max_steps:
+        model.step()
+    row = dict(params)
+    row.update({"Run": run,
+                "Seed": seed,
+                "Steps": model.schedule.steps,
+                "Cleared": not model.mines,
+                "Mines": len(model.mines),
+                "Steps in quickSand": model.quicksandsCounter,
+                "Danger markers": model.markerCounts[MarkerPurpose.DANGER],
+                "Indication markers": model.markerCounts[MarkerPurpose.INDICATION]})
+    return row
+
+
+def summarize(df, params):
+    # Mean steps to clear per configuration with a normal-approximation 95% confidence interval.
+    # Runs stopped by max_steps did not clear the zone: they only count in `uncleared`/`cleared`,
+    # their step count is the cap and would bias the mean down.
+    keys = list(params)
+    summary = df.groupby(keys).agg(runs=("Steps", "size"),
+                                   cleared=("Cleared", "mean"),
+                                   quicksand_mean=("Steps in quickSand", "mean"))
+    steps = df[df["Cleared"]].groupby(keys)["Steps"].agg(cleared_runs="size", steps_mean="mean", steps_std="std")
+    summary = summary.join(steps)
+    summary["cleared_runs"] = summary["cleared_runs"].fillna(0).astype(int)
+    summary["uncleared"] = summary["runs"] - summary["cleared_runs"]
+    half = 1.96 * summary["steps_std"].fillna(0) / np.sqrt(summary["cleared_runs"])
+    summary["steps_ci_low"] = summary["steps_mean"] - half
+    summary["steps_ci_high"] = summary["steps_mean"] + half
+    return summary
+
+
+def run_parallel_batch(params, iterations=10, max_steps=2000, seed=0, processes=None, chunksize=4,
+                       path="MinedZoneBatch.parquet", report_every=10):
+    # Headless sweep: every (configuration, replicate) pair runs with its own seed in a worker
+    # process. All results go to one columnar file (Parquet, or CSV for a .csv path).
+    configs = [dict(zip(params, values)) for values in itertools.product(*params.values())]
+    configs = [c for c in configs for _ in range(iterations)]
+    seeds = np.random.SeedSequence(seed).generate_state(len(configs))
+    tasks = [(run, c, int(s), max_steps) for run, (c, s) in enumerate(zip(configs, seeds))]
+    rows = []
+    start = time.time()
+    with multiprocessing.Pool(processes) as pool:
+        for done, row in enumerate(pool.imap_unordered(run_experiment, tasks, chunksize), 1):
+            rows.append(row)
+            if done % report_every == 0 or done == len(tasks):
+                print("{}/{} runs, {:.1f} runs/s".format(done, len(tasks), done / (time.time() - start)))
+    df = pd.DataFrame(rows, columns=list(params) + ["Run", "Seed"] + BATCH_COLUMNS).sort_values("Run")
+    if path.endswith(".csv"):
+        df.to_csv(path, index=False)
+    else:
+        df.to_parquet(path, index=False)
+    summary = summarize(df, params)
+    print(summary)
+    return df, summary
+
+
 if __name__ == "__main__":
     run_single_server()
@@ -0,0 +1,106 @@
+"""
+End-of-run reporting for MinedZone, kept out of the simulation thread.
+
+The model only calls its end-of-run hooks with itself. `EndOfRunReporter` is such a hook: it
+snapshots the run into a `RunReport` and hands the file output to an `AsyncResultWriter`,
+a background thread that appends result lines and, when asked to, renders the figures.
+Lines are appended with a single O_APPEND write and figures are written to a temporary file
+then renamed, so several runs (threads or processes) sharing a file do not clobber each other.
+"""
+
+import atexit
+import os
+import queue
+import threading
+
+
+class RunReport:
+    # Snapshot of a finished run; the figure is only built when plot() is called
+    def __init__(self, run, steps, cumulative_mines):
+        self.run = run
+        self.steps = steps
+        self.cumulativeMines = list(cumulative_mines)
+
+    def figure(self):
+        from matplotlib.figure import Figure
+        fig = Figure()
+        ax = fig.subplots()
+        ax.plot(range(len(self.cumulativeMines)), self.cumulativeMines)
+        ax.set_xlabel("Step")
+        ax.set_ylabel("Cumulative mines count")
+        return fig
+
+    def plot(self, path):
+        tmp = "{}.{}.{}.tmp{}".format(path, os.getpid(), threading.get_ident(), os.path.splitext(path)[1])
+        self.figure().savefig(tmp)
+        os.replace(tmp, path)
+
+
+class AsyncResultWriter:
+
+    def __init__(self):
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self._work, name="AsyncResultWriter", daemon=True)
+        self.thread.start()
+        atexit.register(self.close)
+
+    def append_line(self, path, line):
+        self.queue.put((self._append, (path, line)))
+
+    def plot(self, report, path):
+        self.queue.put((report.plot, (path,)))
+
+    def _append(self, path, line):
+        fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, (line + "\n").encode())
+        finally:
+            os.close(fd)
+
+    def _work(self):
+        while True:
+            task = self.queue.get()
+            try:
+                if task is None:
+                    return
+                func, args = task
+                try:
+                    func(*args)
+                except Exception as e:
+                    print("AsyncResultWriter: {} failed: {!r}".format(func.__name__, e))
+            finally:
+                self.queue.task_done()
+
+    def flush(self):
+        # Block until everything queued so far is written
+        self.queue.join()
+
+    def close(self):
+        if self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join()
+
+
+class EndOfRunReporter:
+    # Hook for MinedZone(end_of_run_hooks=[...]). Paths may contain "{run}", replaced by the
+    # run number, to give every run its own figure.
+    def __init__(self, writer=None, steps_path="StepCountTillEnd.txt", plot_path=None):
+        self.writer = writer if writer is not None else AsyncResultWriter()
+        self.steps_path = steps_path
+        self.plot_path = plot_path
+        self.reports = []
+
+    def __call__(self, model):
+        report = RunReport(len(self.reports), len(model.cumulativeMines), model.cumulativeMines)
+        self.reports.append(report)
+        if self.steps_path is not None:
+            self.writer.append_line(self.steps_path, str(report.steps))
+        if self.plot_path is not None:
+            self.writer.plot(report, self.plot_path.format(run=report.run))
+        return report
+
+    def plot(self, run=-1, path="CumulativeMinesCount.png"):
+        # Render a finished run on request, in the caller's thread
+        report = self.reports[run]
+        report.plot(path.format(run=report.run))
+        return path
@@ -0,0 +1,65 @@
+"""
+Compact frame format for the canvas elements.
+
+Instead of a list of portrayal dicts per layer, a binary frame carries packed little-endian
+arrays: float32 x/y positions (and angles, NaN where missing, when some object has one) and one uint8 (uint16 past
+256 styles) index per object into a palette of styles. A style is everything in a portrayal
+but its position; each one is sent once per model and kept by the client. Objects are sorted
+by layer and `counts` gives the number of objects of each entry of `layers`.
+The arrays are base64 encoded, since the visualization server sends frames as JSON.
+"""
+
+import base64
+
+import numpy as np
+
+
+def b64(array, dtype):
+    return base64.b64encode(np.ascontiguousarray(array, dtype=dtype).tobytes()).decode("ascii")
+
+
+class BinaryFrameEncoder:
+    dynamic_keys = ("x", "y", "angle")
+
+    def __init__(self):
+        self.model = None
+        self.styles = {}
+
+    def encode(self, model, portrayals):
+        reset = model is not self.model
+        if reset:
+            self.model = model
+            self.styles = {}
+        palette = {}
+        layers, styles, xs, ys, angles = [], [], [], [], []
+        for portrayal in portrayals:
+            style = tuple(sorted((k, v) for k, v in portrayal.items() if k not in self.dynamic_keys))
+            s = self.styles.get(style)
+            if s is None:
+                s = self.styles[style] = len(self.styles)
+                palette[s] = dict(style)
+            layers.append(portrayal["Layer"])
+            styles.append(s)
+            xs.append(portrayal["x"])
+            ys.append(portrayal["y"])
+            angles.append(portrayal.get("angle"))
+        order = sorted(range(len(layers)), key=layers.__getitem__)
+        values, counts = [], []
+        for i in order:
+            if values and values[-1] == layers[i]:
+                counts[-1] += 1
+            else:
+                values.append(layers[i])
+                counts.append(1)
+        wide = len(self.styles) > 256
+        frame = {"binary": True,
+                 "reset": reset,
+                 "palette": palette,
+                 "layers": values,
+                 "counts": counts,
+                 "xy": b64([(xs[i], ys[i]) for i in order] or np.empty((0, 2)), "<f4"),
+                 "style": b64([styles[i] for i in order], "<u2" if wide else "u1"),
+                 "styleBytes": 2 if wide else 1}
+        if any(a is not None for a in angles):
+            frame["angle"] = b64([np.nan if angles[i] is None else angles[i] for i in order], "<f4")
+        return frame
@@ -1,38 +1,86 @@
+import base64
+import functools
+import itertools
 import math
-import random
-import uuid
+import multiprocessing
+import time
 import numpy as np
-from collections import defaultdict
+import pandas as pd
+from collections import defaultdict, deque
 
 import mesa
 import tornado, tornado.ioloop
 from mesa import space 
 from mesa.time import RandomActivation
-from mesa.datacollection import DataCollector
-from mesa.visualization.ModularVisualization import ModularServer, VisualizationElement
-from mesa.visualization.modules.ChartVisualization import ChartModule
+from mesa.visualization.ModularVisualization import VisualizationElement
 from mesa.visualization.ModularVisualization import UserSettableParameter
 
 from mesa.batchrunner import BatchRunner
 
+from collector import ColumnarDataCollector
+from ids import IdAllocator, model_streams
+from frameserver import FrameServer, HistoryChartModule
+from wire import BinaryFrameEncoder
+
 
 dx=[1,1,0,-1, -1, -1,0,1]
 dy=[0,1,1, 1, 0, -1, -1,-1]
 angRanges = [22.5,67.5,112.5,157.5,202.5,247.5,292.5,337.5,400]
 sameDir = 20
 changeDir=50
+unitDir = [(dx[i]/math.hypot(dx[i], dy[i]), dy[i]/math.hypot(dx[i], dy[i])) for i in range(8)]
+
+
+def octant(vx, vy):
+    # Index in dx/dy of the direction of (vx, vy), using the angRanges sectors
+    ang = math.degrees(math.atan2(vy, vx))
+    if(ang<0):
+        ang=360+ang
+    for i in range(len(angRanges)):
+        if ang<=angRanges[i]:
+            return i%8
+    return 0
+
+
+@functools.lru_cache()
+def field_masks(rc, rcn):
+    # Unit vectors from the center of an rc x rc window to each of its cells (zero at the center),
+    # as arrays of shape (2, rc, rc) indexed [component, x offset, y offset]. The second mask is
+    # the correction applied to cows in the inner rcn x rcn window, whose weight counts negatively.
+    r = rc//2
+    offsets = np.arange(-r, r+1, dtype=float)
+    ox, oy = np.meshgrid(offsets, offsets, indexing="ij")
+    norm = np.hypot(ox, oy)
+    norm[r, r] = 1
+    unit = np.stack((ox/norm, oy/norm))
+    inner = np.zeros((rc, rc))
+    inner[r-rcn//2:r+rcn//2+1, r-rcn//2:r+rcn//2+1] = -2
+    return unit, unit*inner
+
+
+@functools.lru_cache()
+def octant_table(r):
+    # octant(vx, vy) for every integer offset up to r, indexed by [vx+r, vy+r]
+    table = np.zeros((2*r+1, 2*r+1), dtype=np.int8)
+    for vx in range(-r, r+1):
+        for vy in range(-r, r+1):
+            table[vx+r, vy+r] = octant(vx, vy)
+    return table
 
 
 class Barn(mesa.Model):
 
-    def __init__(self, grid_width=50, grid_height=50,n_cows=30, n_team=5, corral_sz=5,n_obstacles=5):
+    def __init__(self, grid_width=50, grid_height=50,n_cows=30, n_team=5, corral_sz=5,n_obstacles=5, seed=None,
+                 collector_options=None):
         mesa.Model.__init__(self)
+        self.rng, self.random = model_streams(seed)
+        self.idAllocator = IdAllocator()
         self.space = mesa.space.MultiGrid(grid_width, grid_height, False)
         self.schedule = RandomActivation(self)
 
         self.grid_width = grid_width
         self.grid_height = grid_height
-        self.weight_empty = random.randint(1,10)
+        self.weight_empty = self.random.randint(1,10)
         self.weight_obstacle = -self.weight_empty
         self.obstacles = []
         self.teamCorral1 = []
@@ -56,56 +104,192 @@ class Barn(mesa.Model):
                 s.add((i,j))
                 self.teamCorral2.append((i,j))
         for _ in range(n_obstacles):
-            x = int(random.random()* grid_width)
-            y= int(random.random() * grid_height)
+            x = int(self.random.random()* grid_width)
+            y= int(self.random.random() * grid_height)
             while((x,y) in s):
-                x = int(random.random()* grid_width)
-                y= int(random.random() * grid_height)
+                x = int(self.random.random()* grid_width)
+                y= int(self.random.random() * grid_height)
             s.add((x,y))
             self.obstacles.append((x,y))
         for _ in range(n_cows):
-            x = int(random.random()* grid_width)
-            y= int(random.random() * grid_height)
+            x = int(self.random.random()* grid_width)
+            y= int(self.random.random() * grid_height)
             while((x,y) in s):
-                x = int(random.random()* grid_width)
-                y= int(random.random() * grid_height)
+                x = int(self.random.random()* grid_width)
+                y= int(self.random.random() * grid_height)
             s.add((x,y))
-            self.schedule.add(Cow(x, y, int(uuid.uuid1()), self))
+            self.addAgent(Cow(x, y, self.next_id(), self))
         for _ in range(n_team):
             for j in range(1,3):
-                x = int(random.random()* grid_width)
-                y= int(random.random() * grid_height)
+                x = int(self.random.random()* grid_width)
+                y= int(self.random.random() * grid_height)
                 while((x,y) in s):
-                    x = int(random.random()* grid_width)
-                    y= int(random.random() * grid_height)
+                    x = int(self.random.random()* grid_width)
+                    y= int(self.random.random() * grid_height)
                 s.add((x,y))
-                self.schedule.add(Dog(x, y, int(uuid.uuid1()), self,j))
-
-        self.dc = DataCollector({
+                self.addAgent(Dog(x, y, self.next_id(), self,j))
+
+        # Constant-time cell categories, used by all the movement code. Barn.space only holds the agents.
+        self.obstacleMask = np.zeros((grid_width, grid_height), dtype=bool)
+        self.corralMask = {1: np.zeros((grid_width, grid_height), dtype=bool),
+                           2: np.zeros((grid_width, grid_height), dtype=bool)}
+        for cell in self.obstacles:
+            self.obstacleMask[cell] = True
+        for team, corral in ((1, self.teamCorral1), (2, self.teamCorral2)):
+            for cell in corral:
+                if not self.space.out_of_bounds(cell):
+                    self.corralMask[team][cell] = True
+
+        # Corrals and obstacles never move: the route of each team towards its corral is computed once
+        self.corralDist = {}
+        self.flowDir = {}
+        for team, corral, center in ((1, self.teamCorral1, (self.center1x, self.center1y)),
+                                     (2, self.teamCorral2, (self.center2x, self.center2y))):
+            self.corralDist[team], self.flowDir[team] = self.flowField(corral, center)
+
+        # Dense rasters of the weight each cell has in the cows' field: every agent's weight, obstacle and
+        # empty weights, and a second raster with only the cows. Padded with zeros so that windows
+        # never leave the arrays, and kept up to date by addAgent/removeAgent/moveAgent.
+        self.rasterPad = max([a.rc//2 for a in self.schedule.agents if isinstance(a, Cow)], default=0)
+        self.weights = np.zeros((grid_width+2*self.rasterPad, grid_height+2*self.rasterPad))
+        self.cowWeights = np.zeros_like(self.weights)
+        pad = self.rasterPad
+        self.weights[pad:pad+grid_width, pad:pad+grid_height] = np.where(self.obstacleMask, self.weight_obstacle,
+                                                                         self.weight_empty)
+        for agent in self.schedule.agents:
+            self.updateWeight(agent.pos)
+
+        self.dc = ColumnarDataCollector({
             'Score1': lambda m : m.score1,
             'Score2' : lambda m : m.score2,
             'RemainingCows' : lambda m : m.n_cows-m.score1 - m.score2,
 
-        })
+        }, **(collector_options or {}))
         self.dc.collect(self)
 
 
+    def addAgent(self, agent):
+        self.schedule.add(agent)
+        self.space.place_agent(agent, agent.pos)
+        self.updateWeight(agent.pos)
+
+    def next_id(self):
+        return self.idAllocator.allocate()
+
+    def removeAgent(self, agent):
+        pos = agent.pos
+        self.schedule.remove(agent)
+        self.space.remove_agent(agent)
+        self.updateWeight(pos)
+        self.idAllocator.release(agent.unique_id)
+
+    def moveAgent(self, agent, pos):
+        old = agent.pos
+        self.space.move_agent(agent, pos)
+        self.updateWeight(old)
+        self.updateWeight(pos)
+
+    def updateWeight(self, pos):
+        if getattr(self, "weights", None) is None:
+            return
+        obj = self.occupant(*pos)
+        cell = (pos[0]+self.rasterPad, pos[1]+self.rasterPad)
+        if obj is not None:
+            self.weights[cell] = obj.weight
+        elif self.isObstacle(*pos):
+            self.weights[cell] = self.weight_obstacle
+        else:
+            self.weights[cell] = self.weight_empty
+        self.cowWeights[cell] = obj.weight if isinstance(obj, Cow) else 0
+
+    def field(self, x, y, rc, rcn):
+        # Sum of the unit vectors towards every cell of the rc x rc window around (x, y), weighted by
+        # the cell content; cows closer than rcn//2 count with their weight negated
+        unit, inner = field_masks(rc, rcn)
+        r = rc//2
+        x0, y0 = x+self.rasterPad-r, y+self.rasterPad-r
+        v = np.tensordot(unit, self.weights[x0:x0+rc, y0:y0+rc], 2)
+        v += np.tensordot(inner, self.cowWeights[x0:x0+rc, y0:y0+rc], 2)
+        return v
+
+    def occupant(self, x, y):
+        # Cow or Dog standing on (x, y), or None
+        cell = self.space.grid[x][y]
+        return cell[0] if cell else None
+
+    def isObstacle(self, x, y):
+        return self.obstacleMask[x, y]
+
+    def corralTeam(self, x, y):
+        # Team owning the corral cell (x, y), or 0
+        if self.corralMask[1][x, y]:
+            return 1
+        if self.corralMask[2][x, y]:
+            return 2
+        return 0
+
+    def isFree(self, x, y):
+        if x<0 or x>=self.grid_width or y<0 or y>=self.grid_height:
+            return False
+        return not self.obstacleMask[x, y] and self.occupant(x, y) is None
+
+    def flowField(self, corral, center):
+        # BFS distance (in 8-connected moves avoiding obstacles) from every cell to the corral, and the
+        # index in dx/dy of the next move along a shortest route, or -1 inside the corral and on
+        # unreachable cells. Ties go to the move pointing the most towards the corral center.
+        # The BFS runs on flat Python lists over the grid padded by one blocked cell on each side.
+        w, h = self.grid_width, self.grid_height
+        blocked = np.ones((w+2, h+2), dtype=bool)
+        blocked[1:-1, 1:-1] = self.obstacleMask
+        blocked = blocked.ravel().tolist()
+        offsets = [dx[d]*(h+2)+dy[d] for d in range(8)]
+        dist = [-1]*len(blocked)
+        queue = deque()
+        for cell in corral:
+            if 0<=cell[0]<w and 0<=cell[1]<h and not self.obstacleMask[cell]:
+                i = (cell[0]+1)*(h+2)+cell[1]+1
+                dist[i] = 0
+                queue.append(i)
+        while queue:
+            i = queue.popleft()
+            nd = dist[i]+1
+            for o in offsets:
+                j = i+o
+                if dist[j]<0 and not blocked[j]:
+                    dist[j] = nd
+                    queue.append(j)
+        padded = np.array(dist, dtype=np.int32).reshape(w+2, h+2)
+        dist = padded[1:-1, 1:-1].copy()
+        flow = np.full((w, h), -1, dtype=np.int8)
+        best = np.full((w, h), -np.inf)
+        x, y = np.meshgrid(np.arange(w), np.arange(h), indexing="ij")
+        for d in range(8):
+            step = (dist>0) & (padded[1+dx[d]:w+1+dx[d], 1+dy[d]:h+1+dy[d]]==dist-1)
+            score = unitDir[d][0]*(center[0]-x)+unitDir[d][1]*(center[1]-y)
+            better = step & (score>best)
+            flow[better] = d
+            best[better] = score[better]
+        # Every cell with a route to the corral has its first move
+        assert not ((dist>0) & (flow<0)).any()
+        return dist, flow
+
     def step(self):
+        self.idAllocator.recycle()
         self.dc.collect(self)
         self.schedule.step()
-        if self.schedule.steps >= 1000:
+        if self.schedule.steps >= 1000 or self.score1+self.score2 >= self.n_cows:
             self.running = False
 
 class Cow(mesa.Agent):
     def __init__(self, x, y, unique_id: int, model:Barn, rc = 9, rcn=3):
         super().__init__(unique_id, model)
         self.pos = (x, y)
-        self.w = random.random()*10
+        self.w = self.random.random()*10
         self.model = model
         self.rc = rc
         self.rcn = rcn
-        self.weight = random.randint(1,10)
-        self.turn = random.randint(0,2)
+        self.weight = self.random.randint(1,10)
+        self.turn = self.random.randint(0,2)
         self.steps = 0
     def portrayal_method(self):
         r = 0.5
@@ -122,72 +306,22 @@ class Cow(mesa.Agent):
         self.steps%=3
         if(self.steps!=self.turn):
             return 
-        g = [[1 for i in range(self.rc)] for i in range(self.rc)]
-        rx = self.rc//2
-        ry = self.rc//2
-        for obj in self.model.schedule.agent_buffer():
-            x ,y = obj.pos
-            if(abs(x-self.pos[0])<=self.rc//2 and abs(y-self.pos[1])<=self.rc//2):
-                diffx = x-self.pos[0]
-                diffy = y-self.pos[1]
-                g[ry+diffy][rx+diffx]=obj
-        for (x,y)  in self.model.obstacles : 
-            if(abs(x-self.pos[0])<=self.rc//2 and abs(y-self.pos[1])<=self.rc//2):
-                diffx = x-self.pos[0]
-                diffy = y-self.pos[1]
-                g[ry+diffy][rx+diffx]=-1
-        middle = np.array((rx,ry))
-        v = np.zeros(2)
-        for i in range(self.rc):
-            for j in range(self.rc):
-                x = self.pos[0]-(rx-i)
-                y = self.pos[1]-(ry-j)
-                if(x<0 or x>=self.model.grid_width or y<0 or  y>=self.model.grid_height):
-                    continue
-                if i==rx and j==ry:
-                    continue
-                w=self.model.weight_empty
-                if(isinstance(g[j][i],Dog)):
-                    w=g[j][i].weight
-                    
-                elif isinstance(g[j][i],Cow) :
-                    if(abs(i-rx)<=self.rcn//2  and abs(j-ry)<=self.rcn//2):
-                        w  = -g[j][i].weight
-                    else : 
-                        w = g[j][i].weight
-                else :
-                    w*=g[j][i]
-                dif = (np.array((i,j))-middle)
-                
-                v+=w*dif/(np.linalg.norm(dif))
-
-        if(np.linalg.norm(v)<=1e-5):
+        v = self.model.field(self.pos[0], self.pos[1], self.rc, self.rcn)
+        if(math.hypot(v[0], v[1])<=1e-5):
             return
-        
-        v = v/np.linalg.norm(v)
-        ang = np.angle(complex(v[0],v[1]))
-        ang=ang*180/math.pi
-        if(ang<0):
-            ang=360+ang
-        d = 0
-        for i in range(len(angRanges)):
-            if ang<=angRanges[i]:
-                d=i%8
-                break
-        ni = rx+dx[d]
-        nj = ry+dy[d]
+        d = octant(v[0], v[1])
         nx = self.pos[0]+dx[d]
         ny = self.pos[1]+dy[d]
-        if nx>=0 and nx<self.model.grid_width and ny>=0 and  ny<self.model.grid_height:
-            if(isinstance(g[nj][ni],int) and g[nj][ni]==1):
-                if((nx,ny) in self.model.teamCorral1):
-                    self.model.score1+=1
-                    self.model.schedule.remove(self)
-                elif ((nx,ny) in self.model.teamCorral2): 
-                    self.model.score2+=1
-                    self.model.schedule.remove(self)
-                else : 
-                    self.pos=(nx,ny)
+        if self.model.isFree(nx, ny):
+            team = self.model.corralTeam(nx, ny)
+            if(team==1):
+                self.model.score1+=1
+                self.model.removeAgent(self)
+            elif (team==2): 
+                self.model.score2+=1
+                self.model.removeAgent(self)
+            else : 
+                self.model.moveAgent(self, (nx,ny))
 
 
 
@@ -199,11 +333,12 @@ class Dog(mesa.Agent):
     def __init__(self, x, y, unique_id: int, model:Barn, type: int, visibility = 17):
         super().__init__(unique_id, model)
         self.pos = (x, y)
-        self.w = random.random()*20
+        self.w = self.random.random()*20
         self.type = type
         self.model = model
         self.visibility = visibility
-        self.weight = random.randint(-300,-100)
+        self.octants = octant_table(visibility//2)
+        self.weight = self.random.randint(-300,-100)
 
     def portrayal_method(self):
         r = 0.8
@@ -218,123 +353,62 @@ class Dog(mesa.Agent):
                      "r": r}
         return portrayal
 
+    def moveTo(self, nx, ny):
+        if self.model.isFree(nx, ny):
+            self.model.moveAgent(self, (nx,ny))
+
     def step(self):
         cow = None 
         mnang = 500
-        if(self.type==1):
-            to_Cor = np.array((self.model.center1x, self.model.center1y), dtype=float)-np.array(self.pos, dtype=float)
-        else :
-            to_Cor = np.array((self.model.center2x, self.model.center2y), dtype=float)-np.array(self.pos, dtype=float)
-        if(np.linalg.norm(to_Cor)>self.model.corral_sz//2):
-
-            to_Cor =to_Cor/np.linalg.norm(to_Cor)
-            v = np.zeros(2)
-            for obj in self.model.schedule.agent_buffer():
-                if(isinstance(obj, Cow)):
-                    x ,y = obj.pos
-                    if(abs(x-self.pos[0])<=self.visibility//2 and abs(y-self.pos[1])<=self.visibility//2):
-                        to_Cow = (np.array((x, y))-np.array(self.pos)).astype(float)
-                    else :
+        x0, y0 = self.pos
+        # Direction of the next move towards the corral, read from the precomputed flow field
+        d0 = self.model.flowDir[self.type][x0, y0]
+        if(d0>=0):
+            to_Cor = unitDir[d0]
+            r = self.visibility//2
+            for x in range(max(0, x0-r), min(self.model.grid_width, x0+r+1)):
+                for y in range(max(0, y0-r), min(self.model.grid_height, y0+r+1)):
+                    obj = self.model.occupant(x, y)
+                    if(not isinstance(obj, Cow)):
                         continue
-                    to_Cow /=np.linalg.norm(to_Cow)
-                    dot = np.sum(to_Cor*to_Cow)
-                    ang = np.arccos(dot)
-                    ang=ang*180/math.pi
+                    dot = (to_Cor[0]*(x-x0)+to_Cor[1]*(y-y0))/math.hypot(x-x0, y-y0)
+                    ang = math.degrees(math.acos(max(-1.0, min(1.0, dot))))
                     if(ang<mnang):
                         mnang=ang
                         cow = obj
         if(cow is not None):
-            x = cow.pos[0]
-            y =  cow.pos[1]
             if(mnang<=sameDir):
-                v = np.array((x,y)-np.array(self.pos))
-                v = v/np.linalg.norm(v)
-                ang = np.angle(complex(v[0],v[1]))
-                ang=ang*180/math.pi
-                if(ang<0):
-                    ang=360+ang
-                d = 0
-                for i in range(len(angRanges)):
-                    if ang<=angRanges[i]:
-                        d=i%8
-                        break
-                nx = self.pos[0]+dx[d]
-                ny = self.pos[1]+dy[d]
-                if nx>=0 and nx<self.model.grid_width and ny>=0 and  ny<self.model.grid_height:
-                    npos = (nx,ny)
-                    if(npos in self.model.obstacles):
-                        cow=None
-                    cond=True
-                    for obj in self.model.schedule.agent_buffer():
-                        if(obj.pos[0]==nx and obj.pos[1]==ny):
-                            cond=False
-                            break
-                    if(cond):
-                        self.pos=(nx,ny)
+                d = self.octants[cow.pos[0]-x0+r, cow.pos[1]-y0+r]
             elif(mnang<=changeDir):
-                v = np.array((-to_Cor[1], to_Cor[0]))
-                to_Cow = np.array((cow.pos))-np.array(self.pos)
-                det = to_Cor[0]*to_Cow[1] - to_Cor[1]*to_Cow[0]
-                if(det<0):
-                    v*=-1
-                v = v/np.linalg.norm(v)
-                ang = np.angle(complex(v[0],v[1]))
-                ang=ang*180/math.pi
-                if(ang<0):
-                    ang=360+ang
-                d = 0
-                for i in range(len(angRanges)):
-                    if ang<=angRanges[i]:
-                        d=i%8
-                        break
-                nx = self.pos[0]+dx[d]
-                ny = self.pos[1]+dy[d]
-                if nx>=0 and nx<self.model.grid_width and ny>=0 and  ny<self.model.grid_height:
-                    npos = (nx,ny)
-                    if(npos in self.model.obstacles):
-                        cow=None
-                    cond=True
-                    for obj in self.model.schedule.agent_buffer():
-                        if(obj.pos[0]==nx and obj.pos[1]==ny):
-                            cond=False
-                            break
-                    if(cond):
-                        self.pos=(nx,ny)
-
-            else : 
+                det = to_Cor[0]*(cow.pos[1]-y0) - to_Cor[1]*(cow.pos[0]-x0)
+                d = (d0+6)%8 if det<0 else (d0+2)%8
+            else :
+                cow=None
+        if(cow is not None):
+            nx = x0+dx[d]
+            ny = y0+dy[d]
+            if(0<=nx<self.model.grid_width and 0<=ny<self.model.grid_height and self.model.isObstacle(nx, ny)):
                 cow=None
+            else :
+                self.moveTo(nx, ny)
 
         if( cow is None):
-            d = random.randint(0,7)
-            nx = self.pos[0]+dx[d]
-            ny = self.pos[1]+dy[d]
-            if nx>=0 and nx<self.model.grid_width and ny>=0 and  ny<self.model.grid_height:
-                npos = (nx,ny)
-                if(npos in self.model.obstacles):
-                    return
-                cond=True
-                for obj in self.model.schedule.agent_buffer():
-                    if(obj.pos[0]==nx and obj.pos[1]==ny):
-                        cond=False
-                        break
-                if(cond):
-                    self.pos=(nx,ny)
-        
-
-
-
-
+            d = self.random.randint(0,7)
+            self.moveTo(x0+dx[d], y0+dy[d])
 
 
 class CanvasGrid(VisualizationElement):
-    package_includes = ["GridDraw.js", "CanvasModule.js", "InteractionHandler.js"]
+    local_includes = ["./js/GridDraw.js", "./js/CanvasModule.js", "./js/InteractionHandler.js"]
+
+    # Colors of the static cells, index k-1 of the palette is drawn for raster value k
+    static_palette = ["green", "#FEB2A2", "#9AFDFF"]
 
     def __init__(
         self,  
         grid_width=50,
         grid_height=50,
         canvas_width=800,
-        canvas_height=800, instantiate=True,
+        canvas_height=800, instantiate=True, binary=False,
     ):
 
         self.grid_width = grid_width
@@ -342,6 +416,9 @@ class CanvasGrid(VisualizationElement):
         self.canvas_width = canvas_width
         self.canvas_height = canvas_height
         self.identifier = "space-canvas"
+        self.staticModel = None
+        self.binary = binary
+        self.encoder = BinaryFrameEncoder()
 
         new_element = "new CanvasModule({}, {}, {}, {})".format(
             self.canvas_width, self.canvas_height, self.grid_width, self.grid_height
@@ -352,70 +429,121 @@ class CanvasGrid(VisualizationElement):
     def portrayal_method(self, obj):
         return obj.portrayal_method()
 
-    def render(self, model):
-        grid_state = defaultdict(list)
+    def static_layer(self, model):
+        # Obstacles and corrals never move: they are sent once per model instance as a uint8 raster
+        # (base64, x-major) that the client draws into a cached background canvas
+        if model is self.staticModel:
+            return None
+        self.staticModel = model
+        raster = np.zeros((model.grid_width, model.grid_height), dtype=np.uint8)
+        raster[model.obstacleMask] = 1
+        raster[model.corralMask[1]] = 2
+        raster[model.corralMask[2]] = 3
+        return {"width": model.grid_width,
+                "height": model.grid_height,
+                "palette": self.static_palette,
+                "w": 0.9,
+                "h": 0.9,
+                "cells": base64.b64encode(raster.tobytes()).decode("ascii")}
+
+    def portrayals(self, model):
         for obj in model.schedule.agents:
             portrayal = self.portrayal_method(obj)
             if portrayal:
                 portrayal["x"] = obj.pos[0]
                 portrayal["y"] = obj.pos[1]
-                grid_state[portrayal["Layer"]].append(portrayal)
-        for (x,y)  in model.obstacles : 
-            portrayal = { 
-                "Filled": "true",
-                "Color": "green",
-                "Layer":1,
-                "Shape":"rect",
-                "w":0.9,
-                "h":0.9,
-                }
-            if portrayal:
-                portrayal["x"] = x
-                portrayal["y"] = y
-                grid_state[portrayal["Layer"]].append(portrayal)
-        for (x,y)  in model.teamCorral1 : 
-            portrayal = { 
-                "Filled": "true",
-                "Color": "#FEB2A2",
-                "Layer":1,
-                "Shape":"rect",
-                "w":0.9,
-                "h":0.9,
-                }
-            if portrayal:
-                portrayal["x"] = x
-                portrayal["y"] = y
-                grid_state[portrayal["Layer"]].append(portrayal)
+                yield portrayal
 
-        for (x,y)  in model.teamCorral2 : 
-            portrayal = { 
-                "Filled": "true",
-                "Color": "#9AFDFF",
-                "Layer":1,
-                "Shape":"rect",
-                "w":0.9,
-                "h":0.9,
-                }
-            
-            if portrayal:
-                portrayal["x"] = x
-                portrayal["y"] = y
+    def render(self, model):
+        if self.binary:
+            grid_state = self.encoder.encode(model, self.portrayals(model))
+        else:
+            grid_state = defaultdict(list)
+            for portrayal in self.portrayals(model):
                 grid_state[portrayal["Layer"]].append(portrayal)
-
+        static = self.static_layer(model)
+        if static is not None:
+            grid_state["static"] = static
         return grid_state
 
-def run_single_server():
-    server = ModularServer(Barn,
+def run_single_server(steps_per_frame=1, free_run=False):
+    server = FrameServer(Barn,
                            [CanvasGrid(),
-                           ChartModule(series =[{'Label':"Score1","Color":"blue"},
+                           HistoryChartModule(series =[{'Label':"Score1","Color":"blue"},
                                                 {"Label":"Score2","Color":"red"},
                                                 {"Label":"RemainingCows","Color":"black"}]
                                                  ,data_collector_name="dc")],
-                           "Barn",)
+                           "Barn", steps_per_frame=steps_per_frame, free_run=free_run)
     server.port = 8521
     server.launch()
     tornado.ioloop.IOLoop.current().stop()
 
 
+def run_match(task):
+    match, params, seed, max_steps = task
+    model = Barn(**params, seed=seed)
+    while model.running and model.schedule.steps < max_steps:
+        model.step()
+    row = dict(params)
+    row.update({"Match": match,
+                "Seed": seed,
+                "Steps": model.schedule.steps,
+                "Score1": model.score1,
+                "Score2": model.score2,
+                "RemainingCows": model.n_cows-model.score1-model.score2,
+                "Winner": 1 if model.score1>model.score2 else 2 if model.score2>model.score1 else 0})
+    return row
+
+
+def wilson_interval(wins, n, z=1.96):
+    # 95% Wilson score interval of a win rate
+    p = wins/n
+    center = (p+z*z/(2*n))/(1+z*z/n)
+    half = z*np.sqrt(p*(1-p)/n+z*z/(4*n*n))/(1+z*z/n)
+    return center-half, center+half
+
+
+def summarize(df, params):
+    rows = []
+    for config, group in df.groupby(list(params)):
+        n = len(group)
+        row = dict(zip(params, config))
+        row.update({"Matches": n, "Steps": group["Steps"].mean(), "Draws": (group["Winner"]==0).mean()})
+        for team in (1, 2):
+            wins = (group["Winner"]==team).sum()
+            low, high = wilson_interval(wins, n)
+            row.update({"Win{}".format(team): wins/n,
+                        "Win{}_low".format(team): low,
+                        "Win{}_high".format(team): high,
+                        "Score{}".format(team): group["Score{}".format(team)].mean()})
+        rows.append(row)
+    return pd.DataFrame(rows).set_index(list(params))
+
+
+def run_tournament(params, iterations=100, max_steps=1000, seed=0, processes=None, chunksize=8,
+                   path="BarnTournament.parquet", report_every=100):
+    # Headless matches between team 1 and team 2 over every combination of the Barn parameters,
+    # each with its own seed, in a process pool. Results go to one Parquet (or .csv) file.
+    configs = [dict(zip(params, values)) for values in itertools.product(*params.values())]
+    configs = [c for c in configs for _ in range(iterations)]
+    seeds = np.random.SeedSequence(seed).generate_state(len(configs))
+    tasks = [(match, c, int(s), max_steps) for match, (c, s) in enumerate(zip(configs, seeds))]
+    rows = []
+    start = time.time()
+    with multiprocessing.Pool(processes) as pool:
+        for done, row in enumerate(pool.imap_unordered(run_match, tasks, chunksize), 1):
+            rows.append(row)
+            if done % report_every == 0 or done == len(tasks):
+                print("{}/{} matches, {:.1f} matches/s".format(done, len(tasks), done/(time.time()-start)))
+    df = pd.DataFrame(rows).sort_values("Match")
+    if path.endswith(".csv"):
+        df.to_csv(path, index=False)
+    else:
+        df.to_parquet(path, index=False)
+    summary = summarize(df, params)
+    print(summary)
+    return df, summary
+
+
 if __name__ == "__main__":
     run_single_server()
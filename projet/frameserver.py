@@ -0,0 +1,129 @@
+"""
+Visualization server whose simulation speed is not tied to the browser's frame rate.
+
+`FrameServer` is a ModularServer with two extra modes:
+- `steps_per_frame=N` advances the model N steps for every frame the browser asks for;
+- `free_run=True` steps the model on a worker thread, and each frame renders the latest state.
+  The worker pauses when no frame has been requested for `idle_timeout` seconds, so the
+  Start/Stop buttons keep working.
+Frames then skip steps, so `HistoryChartModule` sends every data collector row collected
+since the previous frame instead of only the last one, and charts stay complete.
+"""
+
+import json
+import threading
+import time
+
+import tornado.escape
+from mesa.visualization.ModularVisualization import ModularServer, SocketHandler, VisualizationElement
+
+
+class HistoryChartModule(VisualizationElement):
+    package_includes = ["Chart.min.js"]
+    local_includes = ["./js/history_chart_module.js"]
+
+    def __init__(self, series, canvas_height=200, canvas_width=500, data_collector_name="datacollector"):
+        self.series = series
+        self.canvas_height = canvas_height
+        self.canvas_width = canvas_width
+        self.data_collector_name = data_collector_name
+        self.model = None
+        self.sent = 0
+        new_element = "new HistoryChartModule({}, {}, {})".format(json.dumps(series), canvas_width, canvas_height)
+        self.js_code = "elements.push(" + new_element + ");"
+
+    def render(self, model):
+        if model is not self.model:
+            self.model = model
+            self.sent = 0
+        # Row numbers count the whole history, spilled rows included
+        collector = getattr(model, self.data_collector_name)
+        start, end = self.sent, len(collector)
+        values = [collector.model_vars[s["Label"]][start:end] for s in self.series]
+        self.sent = end
+        return {"start": start, "rows": [list(row) for row in zip(*values)]}
+
+
+class FrameSocketHandler(SocketHandler):
+
+    def on_message(self, message):
+        msg = tornado.escape.json_decode(message)
+        if msg["type"] != "get_step":
+            return super().on_message(message)
+        if self.application.advance():
+            self.write_message(self.viz_state_message)
+        else:
+            self.write_message({"type": "end"})
+
+
+class FrameServer(ModularServer):
+    socket_handler = (r"/ws", FrameSocketHandler)
+    handlers = [ModularServer.page_handler, socket_handler, ModularServer.static_handler,
+                ModularServer.local_handler]
+
+    def __init__(self, model_cls, visualization_elements, name="Mesa Model", model_params={},
+                 steps_per_frame=1, free_run=False, idle_timeout=2.0):
+        self.steps_per_frame = steps_per_frame
+        self.free_run = free_run
+        self.idle_timeout = idle_timeout
+        self.lock = threading.Lock()
+        self.renderPending = threading.Event()
+        self.stopWorker = threading.Event()
+        self.worker = None
+        self.lastFrame = 0.0
+        self.finalModel = None
+        ModularServer.__init__(self, model_cls, visualization_elements, name, model_params)
+
+    def reset_model(self):
+        self.stop()
+        with self.lock:
+            ModularServer.reset_model(self)
+
+    def render_model(self):
+        # The worker steps under the same lock; renderPending makes it yield between two steps
+        self.renderPending.set()
+        with self.lock:
+            self.renderPending.clear()
+            return ModularServer.render_model(self)
+
+    def advance(self):
+        # Called for every frame requested by the browser; False once there is nothing left to show
+        self.lastFrame = time.monotonic()
+        if self.free_run:
+            if self.model.running:
+                if self.worker is None or not self.worker.is_alive():
+                    self.stopWorker.clear()
+                    self.worker = threading.Thread(target=self.run, name="FrameServerWorker", daemon=True)
+                    self.worker.start()
+                return True
+            # The run ended on the worker: send the final state once, then end
+            if self.finalModel is self.model:
+                return False
+            self.finalModel = self.model
+            return True
+        if not self.model.running:
+            return False
+        with self.lock:
+            for _ in range(self.steps_per_frame):
+                self.model.step()
+                if not self.model.running:
+                    break
+        return True
+
+    def run(self):
+        while not self.stopWorker.is_set():
+            if time.monotonic() - self.lastFrame > self.idle_timeout:
+                return
+            if self.renderPending.is_set():
+                time.sleep(0.001)
+                continue
+            with self.lock:
+                if not self.model.running or self.model.schedule.steps >= self.max_steps:
+                    return
+                self.model.step()
+
+    def stop(self):
+        if self.worker is not None:
+            self.stopWorker.set()
+            self.worker.join()
+            self.worker = None
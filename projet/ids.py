@@ -0,0 +1,47 @@
+"""
+Per-model identity: small integer agent ids and the random streams of a model.
+
+Mesa's schedulers key their agent dict by unique_id, so small ints hash fast and keep the dict
+compact. Ids are handed out in increasing order. An id released after schedule.remove is only
+reused from the next model step, so an agent removed during a step can never be confused with a
+new agent that takes its id while the scheduler is still iterating over that step's keys.
+"""
+
+import heapq
+import random
+
+import numpy as np
+
+
+def model_streams(seed=None):
+    """
+    Independent random streams derived from one seed (None draws OS entropy): a NumPy Generator
+    for batched draws and a random.Random for scalar draws and the scheduler. Models assign the
+    latter to self.random, replacing the Random that Mesa sets on the Model class and shares
+    between every instance.
+    """
+    rng_seq, py_seq = np.random.SeedSequence(seed).spawn(2)
+    return np.random.default_rng(rng_seq), random.Random(int(py_seq.generate_state(1, np.uint64)[0]))
+
+
+class IdAllocator:
+
+    def __init__(self):
+        self.last = 0
+        self.free = []  # heap of ids that can be reused, lowest first
+        self.released = []  # ids released during the current step
+
+    def allocate(self):
+        if self.free:
+            return heapq.heappop(self.free)
+        self.last += 1
+        return self.last
+
+    def release(self, unique_id):
+        self.released.append(unique_id)
+
+    def recycle(self):
+        # Called at the start of every model step
+        for unique_id in self.released:
+            heapq.heappush(self.free, unique_id)
+        self.released.clear()
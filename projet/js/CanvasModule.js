@@ -24,14 +24,59 @@ var CanvasModule = function(canvas_width, canvas_height, grid_width, grid_height
 	var interactionHandler = new InteractionHandler(canvas_width, canvas_height, grid_width, grid_height, interaction_canvas.getContext("2d"));
 	var canvasDraw = new GridVisualization(canvas_width, canvas_height, grid_width, grid_height, context, interactionHandler);
 
+	// Palette kept between binary frames (see wire.BinaryFrameEncoder)
+	var binaryPalette = {};
+
+	var decodeArray = function(b64, Type) {
+		var bytes = atob(b64);
+		var buffer = new Uint8Array(bytes.length);
+		for (var i = 0; i < bytes.length; i++)
+			buffer[i] = bytes.charCodeAt(i);
+		return new Type(buffer.buffer);
+	};
+
+	var decodeBinary = function(data) {
+		if (data.reset)
+			binaryPalette = {};
+		for (var s in data.palette)
+			binaryPalette[s] = data.palette[s];
+		var xy = decodeArray(data.xy, Float32Array);
+		var style = decodeArray(data.style, data.styleBytes == 2 ? Uint16Array : Uint8Array);
+		var angle = data.angle ? decodeArray(data.angle, Float32Array) : null;
+		var layers = {};
+		var i = 0;
+		for (var l = 0; l < data.layers.length; l++) {
+			var layer = layers[data.layers[l]] = [];
+			for (var end = i + data.counts[l]; i < end; i++) {
+				var p = Object.assign({}, binaryPalette[style[i]]);
+				p.x = xy[2 * i];
+				p.y = xy[2 * i + 1];
+				if (angle && !isNaN(angle[i]))
+					p.angle = angle[i];
+				layer.push(p);
+			}
+		}
+		return layers;
+	};
+
 	this.render = function(data) {
+		// Static cells come once per model, in the "static" entry, and are cached by canvasDraw
+		if (data.static) {
+			canvasDraw.drawStatic(data.static);
+			delete data.static;
+		}
+		if (data.binary)
+			data = decodeBinary(data);
 		canvasDraw.resetCanvas();
+		canvasDraw.drawBackground();
 		for (var layer in data)
 			canvasDraw.drawLayer(data[layer]);
 		canvasDraw.drawGridLines("#eee");
 	};
 
 	this.reset = function() {
+		binaryPalette = {};
+		canvasDraw.clearBackground();
 		canvasDraw.resetCanvas();
 	};
 
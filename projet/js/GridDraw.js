@@ -48,6 +48,55 @@ var GridVisualization = function(width, height, gridWidth, gridHeight, context,
     // cell of the grid.
     var maxR = Math.min(cellHeight, cellWidth)/2 - 1;
 
+    // Offscreen canvas holding the static cells, copied under the agents on every frame
+    var background = document.createElement("canvas");
+    background.width = width;
+    background.height = height;
+    var backgroundContext = background.getContext("2d");
+    var hasBackground = false;
+
+    /**
+    Draw the static raster into the background canvas.
+    raster: {width, height, palette, w, h, cells}, where cells is a base64 uint8 array indexed
+    x * height + y; a value k > 0 fills the cell with palette[k - 1].
+    */
+    this.drawStatic = function(raster) {
+            var bytes = atob(raster.cells);
+            var cells = new Uint8Array(bytes.length);
+            for (var i = 0; i < bytes.length; i++)
+                    cells[i] = bytes.charCodeAt(i);
+
+            var dx = raster.w * cellWidth;
+            var dy = raster.h * cellHeight;
+            backgroundContext.clearRect(0, 0, width, height);
+            // One path per palette color
+            for (var k = 1; k <= raster.palette.length; k++) {
+                    backgroundContext.beginPath();
+                    for (var i = 0; i < cells.length; i++) {
+                            if (cells[i] !== k)
+                                    continue;
+                            var x = Math.floor(i / raster.height);
+                            var y = gridHeight - (i % raster.height) - 1;
+                            backgroundContext.rect((x + 0.5) * cellWidth - dx/2, (y + 0.5) * cellHeight - dy/2, dx, dy);
+                    }
+                    backgroundContext.fillStyle = raster.palette[k - 1];
+                    backgroundContext.strokeStyle = raster.palette[k - 1];
+                    backgroundContext.fill();
+                    backgroundContext.stroke();
+            }
+            hasBackground = true;
+    };
+
+    this.drawBackground = function() {
+            if (hasBackground)
+                    context.drawImage(background, 0, 0);
+    };
+
+    this.clearBackground = function() {
+            backgroundContext.clearRect(0, 0, width, height);
+            hasBackground = false;
+    };
+
     // Calls the appropriate shape(agent)
     this.drawLayer = function(portrayalLayer) {
             // Re-initialize the lookup table